@@ -2,12 +2,40 @@
 배터리 양극재 데이터 로드
 
 기존 materials_data.csv 또는 테스트 데이터에서 Li 함유 양극재 추출
+결과는 컬럼 단위 이진 저장소(battery_cathodes.store/)로 저장
 """
 
+import argparse
 import os
 import json
-import random
-from typing import List, Dict, Any
+from typing import Iterator, List, Dict, Any, Optional
+
+import numpy as np
+
+from composition import categorize, element_masks, select
+from instrumentation import Instrumentation
+from material_store import STRING_COLUMNS, StoreWriter, open_store, save_columns, save_store
+from stage_cache import StageCache
+from synthetic import generate_columns, generate_materials
+
+# CSV에서 읽는 컬럼과 dtype (없는 선택 컬럼은 기본값 사용)
+CSV_DTYPES = {
+    'material_id': 'string',
+    'formula': 'string',
+    'density': 'float64',
+    'band_gap': 'float64',
+    'formation_energy_per_atom': 'float64',
+    'volume': 'float64',
+}
+REQUIRED_COLUMNS = ['formula', 'density', 'band_gap']
+DEFAULT_CHUNK_SIZE = 100_000
+DEFAULT_STORE_PATH = 'battery_cathodes.store'
+DEFAULT_CSV_PATH = 'materials_data.csv'
+DEFAULT_LIMIT = 100
+
+# 저장소 내용을 결정하는 코드 (바뀌면 캐시된 저장소는 무효)
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGE_SOURCES = [os.path.join(SCRIPT_DIR, name) for name in ['1_dataload.py', 'composition.py', 'material_store.py']]
 
 
 class BatteryCathodeMaterialLoader:
@@ -17,108 +45,219 @@ class BatteryCathodeMaterialLoader:
         """초기화"""
         self.materials = []
     
-    def load_from_csv(self, csv_file: str = 'materials_data.csv', limit: int = 100) -> List[Dict[str, Any]]:
+    def load_from_csv(self, csv_file: str = DEFAULT_CSV_PATH, limit: int = 100,
+                      chunksize: int = DEFAULT_CHUNK_SIZE) -> List[Dict[str, Any]]:
         """
         CSV 파일에서 Li 함유 양극재 로드
         
         Args:
             csv_file: CSV 파일 경로
-            limit: 로드 제한
+            limit: 로드 제한 (None이면 전체)
+            chunksize: 한 번에 읽을 행 수
         
         Returns:
             재료 리스트
         """
         try:
-            import pandas as pd
-            
-            if not os.path.exists(csv_file):
-                print(f"⚠️  {csv_file} 없음. 테스트 데이터 생성합니다.")
+            if not self._check_csv(csv_file):
                 return self._generate_test_data(limit)
             
-            df = pd.read_csv(csv_file)
-            
-            # Li 함유 물질 필터링
-            df_li = df[df['formula'].str.contains('Li', case=False, na=False)].copy()
-            
-            # 필요한 컬럼 확인
-            required_cols = ['formula', 'density', 'band_gap']
-            for col in required_cols:
-                if col not in df_li.columns:
-                    print(f"⚠️  컬럼 '{col}' 없음.")
-                    return self._generate_test_data(limit)
-            
-            # NaN 제거
-            df_li = df_li.dropna(subset=['density', 'band_gap'])
-            
-            # 데이터 변환
-            materials = []
-            for idx, (_, row) in enumerate(df_li.head(limit).iterrows()):
-                mat_dict = {
-                    'material_id': row.get('material_id', f'mp-{1000+idx}'),
-                    'formula': str(row['formula']),
-                    'density': float(row['density']),
-                    'band_gap': float(row['band_gap']),
-                    'formation_energy_per_atom': float(row.get('formation_energy_per_atom', 0.0)) if 'formation_energy_per_atom' in row else 0.0,
-                    'volume': float(row.get('volume', 100.0)) if 'volume' in row else 100.0,
-                }
-                materials.append(mat_dict)
+            materials = list(self.iter_csv(csv_file, limit, chunksize))
             
             self.materials = materials
             print(f"✓ {len(materials)}개 재료 로드됨 ({csv_file}에서)")
             return materials
         
-        except ImportError:
-            print("⚠️  pandas가 필요합니다. 테스트 데이터로 진행합니다.")
-            return self._generate_test_data(limit)
         except Exception as e:
             print(f"✗ CSV 로드 실패: {e}")
             return self._generate_test_data(limit)
     
-    def _generate_test_data(self, limit: int = 50) -> List[Dict[str, Any]]:
-        """테스트용 샘플 데이터 생성"""
-        
-        formulas = [
-            'LiCoO2', 'LiNiO2', 'LiMnO2', 'Li2MnO3',
-            'LiNi0.8Co0.15Al0.05O2', 'LiNi0.5Co0.2Mn0.3O2',
-            'LiFePO4', 'LiMnPO4', 'LiCoPO4',
-            'LiMn2O4', 'LiNi0.5Mn1.5O4', 'LiMnO2',
-            'Li(NiMnCo)O2', 'LiVO2', 'LiTiO2',
-            'LiNbO3', 'LiNiPO4', 'LiFeO2'
-        ]
-        
-        materials = []
-        for i in range(min(limit, 80)):
-            idx = i % len(formulas)
-            formula = formulas[idx]
-            if i >= len(formulas):
-                formula = f"{formula}_{i // len(formulas)}"
-            
-            mat_dict = {
-                'material_id': f'mp-{10000 + i}',
-                'formula': formula,
-                'density': round(random.uniform(2.5, 5.5), 2),
-                'band_gap': round(random.uniform(0.2, 4.5), 2),
-                'formation_energy_per_atom': round(random.uniform(-4.0, 0.5), 3),
-                'volume': round(random.uniform(50.0, 200.0), 1),
-            }
-            materials.append(mat_dict)
+    def load_to_store(self, csv_file: str = DEFAULT_CSV_PATH, output_path: str = DEFAULT_STORE_PATH,
+                      limit: int = 100, chunksize: int = DEFAULT_CHUNK_SIZE) -> int:
+        """
+        CSV 파일의 Li 함유 양극재를 청크 단위로 저장소에 바로 저장
+        
+        청크의 컬럼을 그대로 저장소에 추가하므로(material_store.StoreWriter)
+        재료 dict나 전체 재료 목록을 만들지 않습니다. CSV를 읽을 수 없으면
+        load_from_csv()처럼 테스트 데이터를 저장합니다.
+        
+        Returns:
+            저장한 재료 수
+        """
+        try:
+            if self._check_csv(csv_file):
+                writer = StoreWriter(output_path)
+                for columns in self.iter_csv_columns(csv_file, limit, chunksize):
+                    strings = {name: columns.pop(name) for name in STRING_COLUMNS}
+                    writer.append(columns, strings, categorize(element_masks(strings['formula'])))
+                writer.close()
+                print(f"✓ {writer.count}개 재료 저장됨 ({csv_file}에서): {output_path}")
+                return writer.count
+        except Exception as e:
+            print(f"✗ CSV 로드 실패: {e}")
+        
+        materials = self._generate_test_data(limit)
+        self.save_to_store(materials, output_path)
+        return len(materials)
+    
+    def _check_csv(self, csv_file: str) -> bool:
+        """CSV를 읽을 수 있는지 확인 (없으면 이유 출력)"""
+        try:
+            import pandas as pd
+        except ImportError:
+            print("⚠️  pandas가 필요합니다. 테스트 데이터로 진행합니다.")
+            return False
+        
+        if not os.path.exists(csv_file):
+            print(f"⚠️  {csv_file} 없음. 테스트 데이터 생성합니다.")
+            return False
+        
+        # 필요한 컬럼 확인
+        header = pd.read_csv(csv_file, nrows=0).columns
+        for col in REQUIRED_COLUMNS:
+            if col not in header:
+                print(f"⚠️  컬럼 '{col}' 없음.")
+                return False
+        return True
+    
+    def iter_csv(self, csv_file: str, limit: Optional[int] = None,
+                 chunksize: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+        """
+        CSV 파일에서 Li 함유 양극재를 청크 단위로 읽어 하나씩 반환
+        
+        Args:
+            csv_file: CSV 파일 경로
+            limit: 반환할 최대 재료 수 (None이면 전체)
+            chunksize: 한 번에 읽을 행 수
+        
+        Yields:
+            재료 dict
+        
+        Raises:
+            ValueError: 필수 컬럼이 없을 때
+        """
+        for columns in self.iter_csv_columns(csv_file, limit, chunksize):
+            columns = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                       for key, value in columns.items()}
+            for values in zip(*columns.values()):
+                yield dict(zip(columns, values))
+    
+    def iter_csv_columns(self, csv_file: str, limit: Optional[int] = None,
+                         chunksize: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+        """
+        CSV 파일에서 Li 함유 양극재를 청크 단위로 읽어 청크별 컬럼으로 반환
+        
+        필요한 컬럼만 고정 dtype으로 읽고, 청크마다 Li 필터와 변환을
+        컬럼 단위로 처리하므로 전체 CSV를 메모리에 올리지 않습니다.
+        
+        Args:
+            csv_file: CSV 파일 경로
+            limit: 반환할 최대 재료 수 (None이면 전체)
+            chunksize: 한 번에 읽을 행 수
+        
+        Yields:
+            {컬럼: 값} (문자열 컬럼은 str 리스트, 숫자 컬럼은 float64 배열)
+        
+        Raises:
+            ValueError: 필수 컬럼이 없을 때
+        """
+        import pandas as pd
+        
+        header = pd.read_csv(csv_file, nrows=0).columns
+        for col in REQUIRED_COLUMNS:
+            if col not in header:
+                raise ValueError(f"컬럼 '{col}' 없음")
+        usecols = [col for col in CSV_DTYPES if col in header]
+        
+        count = 0
+        with pd.read_csv(csv_file, usecols=usecols, dtype={col: CSV_DTYPES[col] for col in usecols},
+                         chunksize=chunksize) as reader:
+            for chunk in reader:
+                # Li 함유 물질 필터링 (화학식 파싱, 원소 비트마스크), NaN 제거
+                formulas = chunk['formula'].fillna('').tolist()
+                chunk = chunk[select(element_masks(formulas), include=['Li'])]
+                chunk = chunk.dropna(subset=['density', 'band_gap'])
+                if limit is not None:
+                    chunk = chunk.head(limit - count)
+                if chunk.empty:
+                    continue
+                
+                # 데이터 변환 (컬럼 단위)
+                generated_ids = pd.Series([f'mp-{1000 + idx}' for idx in range(count, count + len(chunk))],
+                                          index=chunk.index)
+                strings = {
+                    'material_id': chunk['material_id'].fillna(generated_ids) if 'material_id' in chunk else generated_ids,
+                    'formula': chunk['formula'],
+                }
+                numeric = {
+                    'density': chunk['density'],
+                    'band_gap': chunk['band_gap'],
+                    'formation_energy_per_atom': chunk.get('formation_energy_per_atom', 0.0),
+                    'volume': chunk.get('volume', 100.0),
+                }
+                columns = {key: value.tolist() for key, value in strings.items()}
+                columns.update({
+                    key: value.to_numpy(dtype=np.float64) if isinstance(value, pd.Series) else np.full(len(chunk), value)
+                    for key, value in numeric.items()
+                })
+                yield columns
+                
+                count += len(chunk)
+                if limit is not None and count >= limit:
+                    return
+    
+    def _generate_test_data(self, limit: int = 50, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        테스트용 합성 데이터 생성 (synthetic.py)
+        
+        양극재 계열별 조성 변형과 특성 분포에서 limit개를 벡터 연산으로
+        생성합니다. 같은 seed면 항상 같은 데이터 (None이면 매번 다름).
+        """
+        materials = generate_materials(limit, seed)
         
         self.materials = materials
         print(f"✓ {len(materials)}개 테스트 재료 생성됨")
         return materials
     
+    def save_synthetic_store(self, n: int, seed: int = 0, output_path: str = DEFAULT_STORE_PATH):
+        """
+        합성 재료 n개를 저장소로 바로 저장 (10k~1M 규모 테스트용)
+        
+        재료 dict를 만들지 않고 생성된 컬럼을 그대로 기록합니다.
+        """
+        numeric, strings = generate_columns(n, seed)
+        categories = {name: rows.tolist() for name, rows in categorize(element_masks(strings['formula'])).items()}
+        save_columns(output_path, numeric, strings, categories)
+        print(f"✓ {n}개 합성 재료 저장됨 (시드 {seed}): {output_path}")
+    
+    def classify(self, data: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+        """
+        카테고리별 재료 인덱스
+        
+        화학식을 원소 비트마스크로 바꿔 composition.CATEGORY_RULES의 포함/제외
+        원소 조건을 전체 재료에 한 번에 적용합니다.
+        """
+        masks = element_masks([m['formula'] for m in data])
+        return {name: rows.tolist() for name, rows in categorize(masks).items()}
+    
+    def save_to_store(self, data: List[Dict[str, Any]], output_path: str = DEFAULT_STORE_PATH):
+        """
+        컬럼 단위 이진 저장소로 저장
+        
+        재료는 한 번씩만 저장하고 카테고리는 행 인덱스 목록으로 저장합니다
+        (material_store.py 참고).
+        """
+        save_store(output_path, data, self.classify(data))
+        print(f"✓ 데이터 저장됨: {output_path}")
+    
     def save_to_json(self, data: List[Dict[str, Any]], output_path: str = 'battery_cathodes.json'):
-        """JSON으로 저장"""
+        """JSON으로 저장 (카테고리마다 재료 전체를 중복 기록)"""
         
         os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
         
         # 카테고리별로 분류 (간단한 분류)
-        output = {
-            'LCO': [m for m in data if 'Co' in m['formula'] and 'Mn' not in m['formula']],
-            'NCM': [m for m in data if 'Ni' in m['formula'] and 'Mn' in m['formula']],
-            'LFP': [m for m in data if 'Fe' in m['formula'] and 'P' in m['formula']],
-            'General': data
-        }
+        output = {name: [data[i] for i in rows] for name, rows in self.classify(data).items()}
+        output['General'] = data
         
         with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(output, f, indent=2, ensure_ascii=False)
@@ -129,29 +268,75 @@ class BatteryCathodeMaterialLoader:
 def main():
     """메인 실행 함수"""
     
+    parser = argparse.ArgumentParser(description='배터리 양극재 데이터 로드')
+    parser.add_argument('--synthetic', type=int, metavar='N', help='CSV 대신 합성 재료 N개로 저장소 생성')
+    parser.add_argument('--seed', type=int, default=0, help='--synthetic 난수 시드 (기본값: 0)')
+    parser.add_argument('--metrics', metavar='PATH', help='단계별 시간/메모리/처리량을 JSON으로 저장')
+    parser.add_argument('--trace-malloc', action='store_true', help='tracemalloc으로 최대 할당량도 기록 (느려짐)')
+    parser.add_argument('--profile', action='store_true', help='로드 단계를 cProfile로 프로파일링')
+    args = parser.parse_args()
+    
+    # CSV 읽기(또는 합성 데이터 생성)가 가장 오래 걸리는 단계
+    metrics = Instrumentation('1_dataload', trace_malloc=args.trace_malloc,
+                              profile=('synthetic' if args.synthetic else 'load') if args.profile else None)
+    try:
+        run(args, metrics)
+    finally:
+        if args.metrics:
+            metrics.write(args.metrics)
+            print(f"✓ 단계별 측정값 저장됨: {args.metrics}")
+
+
+def run(args: argparse.Namespace, metrics: Instrumentation):
+    """main()의 단계를 metrics로 측정하며 실행"""
+    
     print("=" * 70)
     print("배터리 양극재 데이터 로드")
     print("=" * 70)
     
+    if args.synthetic:
+        with metrics.stage('synthetic', rows=args.synthetic):
+            BatteryCathodeMaterialLoader().save_synthetic_store(args.synthetic, args.seed)
+        print("\n✓ 다음 단계: python 2_processing.py")
+        return
+    
+    # CSV가 그대로면 이전 실행의 저장소를 재사용 (테스트 데이터는 매번 생성)
+    cache = StageCache()
+    key = None
+    if os.path.exists(DEFAULT_CSV_PATH):
+        with metrics.stage('cache') as record:
+            params = {'limit': DEFAULT_LIMIT, 'dtypes': CSV_DTYPES, 'required': REQUIRED_COLUMNS}
+            key = cache.key('dataload', STAGE_SOURCES, [DEFAULT_CSV_PATH], params)
+            record['hit'] = cache.restore(key, [DEFAULT_STORE_PATH])
+        if record['hit']:
+            print(f"✓ 입력 변경 없음, 단계 캐시에서 저장소 사용: {DEFAULT_STORE_PATH} (키 {key[:12]})")
+            print("\n✓ 다음 단계: python 2_processing.py")
+            return
+    
     # 로더 초기화
     loader = BatteryCathodeMaterialLoader()
     
-    # 데이터 로드 (CSV 또는 테스트)
-    materials = loader.load_from_csv(limit=100)
+    # 데이터 로드 (CSV 또는 테스트), 청크마다 저장소에 추가
+    with metrics.stage('load') as record:
+        record['rows'] = loader.load_to_store(DEFAULT_CSV_PATH, DEFAULT_STORE_PATH, limit=DEFAULT_LIMIT)
     
-    # 저장
-    loader.save_to_json(materials, 'battery_cathodes.json')
+    # 캐시에 저장
+    if key is not None:
+        with metrics.stage('store', rows=record['rows']):
+            cache.store(key, 'dataload', [DEFAULT_STORE_PATH])
     
-    # 요약
+    # 요약 (저장소에서 읽음)
+    store = open_store(DEFAULT_STORE_PATH)
+    density, band_gap = store.columns['density'], store.columns['band_gap']
     print("\n" + "=" * 70)
     print("로드 완료 요약")
     print("=" * 70)
-    print(f"총 {len(materials)}개 재료")
-    print(f"  - 밀도 범위: {min(m['density'] for m in materials):.2f} ~ {max(m['density'] for m in materials):.2f}")
-    print(f"  - 밴드갭 범위: {min(m['band_gap'] for m in materials):.2f} ~ {max(m['band_gap'] for m in materials):.2f}")
+    print(f"총 {len(store)}개 재료")
+    print(f"  - 밀도 범위: {np.nanmin(density):.2f} ~ {np.nanmax(density):.2f}")
+    print(f"  - 밴드갭 범위: {np.nanmin(band_gap):.2f} ~ {np.nanmax(band_gap):.2f}")
     
     print("\n샘플 데이터:")
-    for mat in materials[:5]:
+    for mat in store.rows(range(min(5, len(store)))):
         print(f"  - {mat['formula']:20} (밀도: {mat['density']:.2f}, 밴드갭: {mat['band_gap']:.2f})")
     
     print(f"\n✓ 다음 단계: python 2_processing.py")
@@ -1,43 +1,35 @@
 """
 배터리 양극재 데이터 전처리 및 유사도 계산
+
+Usage:
+  python 2_processing.py                        # Default (block size 1024)
+  python 2_processing.py --block-size 256       # Smaller tiles
+  python 2_processing.py --max-memory-mb 512    # Pick tile size from memory ceiling
+  python 2_processing.py --workers 8            # Shard rows across 8 processes
+  python 2_processing.py --metrics m.json --profile   # Per-stage metrics + cProfile of the build
+
+Library use (the file name is not a valid module name, so load it by path):
+  spec = importlib.util.spec_from_file_location('processing', '2_processing.py')
+  processing = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(processing)
+  builder = processing.SimilarityGraphBuilder().fit(processing.load_materials('battery_cathodes.store'))
+  adjacency = builder.build(knn=10)
 """
 
+import argparse
+import bisect
 import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics.pairwise import cosine_similarity
 
-print("=" * 70)
-print("Battery Cathode Material - Preprocessing & Similarity")
-print("=" * 70)
-
-# === 1. Data Load ===
-data_path = 'battery_cathodes.json'
-with open(data_path, 'r', encoding='utf-8') as f:
-    data = json.load(f)
-
-# Merge categories
-all_materials = []
-if isinstance(data, dict):
-    for category, materials in data.items():
-        if isinstance(materials, list):
-            all_materials.extend(materials)
-else:
-    all_materials = data
-
-# Remove duplicates
-seen_ids = set()
-materials = []
-for mat in all_materials:
-    mat_id = mat.get('material_id', 'unknown')
-    if mat_id not in seen_ids:
-        seen_ids.add(mat_id)
-        materials.append(mat)
-
-print("[OK] {} unique materials loaded".format(len(materials)))
-
-# === 2. Feature Extraction & Normalization ===
-print("\n[Preprocessing] Feature extraction & normalization...")
+from graph_store import CSRGraph, is_csr_file, load_csr, save_csr
+from material_store import MaterialStore, append_store, is_store, open_store
+from instrumentation import Instrumentation
+from stage_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_MB, StageCache
 
 IMPORTANT_FEATURES = ['density', 'band_gap', 'formation_energy_per_atom', 'volume']
 FEATURE_WEIGHTS = {
@@ -47,174 +39,1114 @@ FEATURE_WEIGHTS = {
     'band_gap': 0.1
 }
 
-feature_matrix = []
-valid_materials = []
-material_to_idx = {}
-idx_to_material = {}
-
-for mat in materials:
-    features = []
-    valid = True
-    
-    for feature in IMPORTANT_FEATURES:
-        value = mat.get(feature)
-        if value is None:
-            valid = False
-            break
-        try:
-            features.append(float(value))
-        except:
-            valid = False
-            break
-    
-    if valid and len(features) == 4:
-        feature_matrix.append(features)
-        idx = len(valid_materials)
-        formula = mat.get('formula', 'Material_{}'.format(idx))
-        material_to_idx[formula] = idx
-        idx_to_material[idx] = formula
-        valid_materials.append(mat)
-
-print("[OK] {} materials used".format(len(valid_materials)))
-
-# Normalize
-if len(feature_matrix) == 0:
-    print("[ERROR] No valid data")
-    exit(1)
-
-feature_matrix = np.array(feature_matrix, dtype=float)
-scaler = MinMaxScaler()
-normalized_features = scaler.fit_transform(feature_matrix)
-
-print("[OK] {} materials normalized".format(len(normalized_features)))
-
-# === 3. Similarity Calculation ===
-print("\n[Similarity] Calculating...")
-n = len(normalized_features)
-
-def euclidean_sim(i, j):
-    vec_i = normalized_features[i]
-    vec_j = normalized_features[j]
-    weighted_diff = np.array([
-        (vec_i[k] - vec_j[k]) ** 2 * FEATURE_WEIGHTS[IMPORTANT_FEATURES[k]]
-        for k in range(4)
-    ])
-    dist = np.sqrt(np.sum(weighted_diff))
-    return 1.0 / (1.0 + dist)
-
-def cosine_sim(i, j):
-    vec_i = normalized_features[i].reshape(1, -1)
-    vec_j = normalized_features[j].reshape(1, -1)
-    return float(cosine_similarity(vec_i, vec_j)[0, 0])
-
-def structural_sim(i, j):
-    mat_i = valid_materials[i]
-    mat_j = valid_materials[j]
-    
-    bg_i = mat_i.get('band_gap', 2.0)
-    bg_j = mat_j.get('band_gap', 2.0)
-    bg_sim = np.exp(-abs(bg_i - bg_j) / 0.5)
-    
-    rho_i = mat_i.get('density', 3.0)
-    rho_j = mat_j.get('density', 3.0)
-    if rho_i > 0 and rho_j > 0:
-        rho_sim = np.exp(-abs(np.log(rho_i / rho_j)) / 0.2)
-    else:
-        rho_sim = 0.5
-    
-    return (bg_sim + rho_sim) / 2.0
-
 SIMILARITY_WEIGHTS = {
     'euclidean': 0.25,
     'cosine': 0.5,
     'structural': 0.25
 }
 
-def hybrid_sim(i, j):
-    e_sim = euclidean_sim(i, j)
-    c_sim = cosine_sim(i, j)
-    s_sim = structural_sim(i, j)
+DEFAULT_THRESHOLD = 0.85
+# Looked up in order when --input is not given
+DEFAULT_INPUTS = ['battery_cathodes.store', 'battery_cathodes.json']
+DEFAULT_OUTPUTS = {'csr': 'adjacency_graph.csr', 'json': 'adjacency_list.json'}
+DEFAULT_BLOCK_SIZE = 1024
+# Build parameters of a JSON graph are kept next to it in <output> + PARAMS_SUFFIX
+# (a CSR graph keeps them in its header)
+PARAMS_SUFFIX = '.params.json'
+
+# float64 tile-sized arrays alive at once while scoring one tile
+TILE_TEMPORARIES = 8
+
+# Auto threshold: quantile of all pairwise scores, estimated with this many histogram bins
+AUTO_THRESHOLD_QUANTILE = 0.8
+QUANTILE_BINS = 1 << 16
+
+# Code that decides the graph; editing any of it invalidates cached graphs
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGE_SOURCES = [os.path.join(SCRIPT_DIR, name) for name in ['2_processing.py', 'graph_store.py', 'material_store.py']]
+
+
+# === 1. Data Load ===
+def load_materials(data_path):
+    """
+    Load materials
+
+    A columnar store (material_store.py) is opened as is: it holds each
+    material once. JSON categories are merged and de-duplicated.
+    """
+    if is_store(data_path):
+        return open_store(data_path)
+
+    with open(data_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    # Merge categories
+    all_materials = []
+    if isinstance(data, dict):
+        for category, materials in data.items():
+            if isinstance(materials, list):
+                all_materials.extend(materials)
+    else:
+        all_materials = data
+
+    # Remove duplicates
+    seen_ids = set()
+    materials = []
+    for mat in all_materials:
+        mat_id = mat.get('material_id', 'unknown')
+        if mat_id not in seen_ids:
+            seen_ids.add(mat_id)
+            materials.append(mat)
+
+    return materials
+
+
+# === 2. Feature Extraction & Normalization ===
+def extract_features(materials):
+    """
+    Extract IMPORTANT_FEATURES from each material
+
+    Returns:
+        (feature_matrix, valid_materials, idx_to_material)
+    """
+    if isinstance(materials, MaterialStore):
+        # Columns are already arrays; a row is valid when no feature is missing
+        feature_matrix, rows = materials.features(IMPORTANT_FEATURES)
+        formulas = materials.strings['formula']
+        idx_to_material = {}
+        for idx, row in enumerate(rows.tolist()):
+            idx_to_material[idx] = formulas[row] or 'Material_{}'.format(idx)
+        return feature_matrix, materials.rows(rows), idx_to_material
+
+    feature_matrix = []
+    valid_materials = []
+    idx_to_material = {}
+
+    for mat in materials:
+        features = []
+        valid = True
+
+        for feature in IMPORTANT_FEATURES:
+            value = mat.get(feature)
+            if value is None:
+                valid = False
+                break
+            try:
+                features.append(float(value))
+            except:
+                valid = False
+                break
+
+        if valid and len(features) == 4:
+            feature_matrix.append(features)
+            idx = len(valid_materials)
+            formula = mat.get('formula', 'Material_{}'.format(idx))
+            idx_to_material[idx] = formula
+            valid_materials.append(mat)
+
+    return np.array(feature_matrix, dtype=float), valid_materials, idx_to_material
+
+
+def prepare_features(feature_matrix, scaler=None):
+    """
+    Normalize features and precompute the columns used by the similarity blocks
+
+    Args:
+        scaler: fitted MinMaxScaler to reuse (default: fit one on feature_matrix)
+    """
+    if scaler is None:
+        scaler = MinMaxScaler().fit(feature_matrix)
+    normalized_features = scaler.transform(feature_matrix)
+
+    # Row-normalized features (as sklearn's normalize does, zero rows stay zero)
+    norms = np.sqrt(np.einsum('ij,ij->i', normalized_features, normalized_features))
+    norms[norms == 0.0] = 1.0
+
+    return {
+        'normalized': normalized_features,
+        'unit': normalized_features / norms[:, np.newaxis],
+        'band_gap': feature_matrix[:, IMPORTANT_FEATURES.index('band_gap')],
+        'density': feature_matrix[:, IMPORTANT_FEATURES.index('density')],
+    }
+
+
+# === 3. Similarity Calculation ===
+# Every function scores a whole rows x cols block at once. The blocks are
+# exactly symmetric (score(i, j) == score(j, i) bit for bit), which the
+# upper-triangular build relies on.
+def euclidean_block(features, rows, cols):
+    vec_i = features['normalized'][rows]
+    vec_j = features['normalized'][cols]
+    weighted_sq = np.zeros((len(vec_i), len(vec_j)))
+    for k in range(4):
+        weighted_sq += (vec_i[:, k, np.newaxis] - vec_j[np.newaxis, :, k]) ** 2 * FEATURE_WEIGHTS[IMPORTANT_FEATURES[k]]
+    return 1.0 / (1.0 + np.sqrt(weighted_sq))
+
+
+def cosine_block(features, rows, cols):
+    unit_i = features['unit'][rows]
+    unit_j = features['unit'][cols]
+    dot = np.zeros((len(unit_i), len(unit_j)))
+    for k in range(4):
+        dot += unit_i[:, k, np.newaxis] * unit_j[np.newaxis, :, k]
+    return dot
+
+
+def structural_block(features, rows, cols):
+    bg_i = features['band_gap'][rows][:, np.newaxis]
+    bg_j = features['band_gap'][cols][np.newaxis, :]
+    bg_sim = np.exp(-np.abs(bg_i - bg_j) / 0.5)
+
+    rho_i = features['density'][rows][:, np.newaxis]
+    rho_j = features['density'][cols][np.newaxis, :]
+    positive = (rho_i > 0) & (rho_j > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # |log(rho_i / rho_j)|, written so that swapping i and j gives the same bits
+        rho_sim = np.exp(-np.log(np.maximum(rho_i, rho_j) / np.minimum(rho_i, rho_j)) / 0.2)
+    rho_sim = np.where(positive, rho_sim, 0.5)
+
+    return (bg_sim + rho_sim) / 2.0
+
+
+def hybrid_block(features, rows, cols):
+    """Weighted sum of the three metrics for every i in rows, j in cols"""
+    e_sim = euclidean_block(features, rows, cols)
+    c_sim = cosine_block(features, rows, cols)
+    s_sim = structural_block(features, rows, cols)
     return (SIMILARITY_WEIGHTS['euclidean'] * e_sim +
             SIMILARITY_WEIGHTS['cosine'] * c_sim +
             SIMILARITY_WEIGHTS['structural'] * s_sim)
 
-# Build adjacency list
-adjacency = {}
-similarities = []
-
-for i in range(n):
-    neighbors = []
-    for j in range(n):
-        if i != j:
-            sim = hybrid_sim(i, j)
-            similarities.append(sim)
-            if sim >= 0.85:
-                neighbors.append({
-                    'neighbor': idx_to_material[j],
-                    'similarity': round(sim, 4)
-                })
-    
+
+class StreamingQuantile:
+    """
+    Streaming quantile estimator backed by a fixed-bin histogram over [low, high]
+
+    Memory is O(bins) no matter how many values are fed, and no sort is
+    needed. quantile(q) never exceeds the exact order statistic
+    sorted(values)[int(count * q)] and is at most one bin width
+    ((high - low) / bins) below it.
+    """
+
+    def __init__(self, low=0.0, high=1.0, bins=QUANTILE_BINS):
+        self.low = low
+        self.high = high
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def update(self, values, weight=1):
+        """Add a batch of values, each counted `weight` times"""
+        scaled = (np.asarray(values, dtype=float).ravel() - self.low) * (self.bins / (self.high - self.low))
+        bin_idx = np.clip(scaled.astype(np.int64), 0, self.bins - 1)
+        self.counts += weight * np.bincount(bin_idx, minlength=self.bins)
+
+    def quantile(self, q):
+        """Lower edge of the bin holding the q-th order statistic"""
+        total = self.count
+        if total == 0:
+            raise ValueError("No values added")
+        target_idx = max(0, min(int(total * q), total - 1))
+        bin_idx = int(np.searchsorted(np.cumsum(self.counts), target_idx, side='right'))
+        return self.low + bin_idx * (self.high - self.low) / self.bins
+
+
+class RowCandidates:
+    """
+    Best `capacity` (column, score) pairs seen so far for every row
+
+    Filled during the first tiled pass so that the graph for a lower
+    threshold chosen afterwards can be read back without another
+    all-pairs pass. A row is complete for threshold t unless it filled up
+    and its smallest retained score is still >= t; only such rows need
+    rescoring.
+    """
+
+    def __init__(self, n, capacity, n_cols=None):
+        self.capacity = max(1, min(capacity, n_cols or n))
+        self.cols = np.full((n, self.capacity), -1, dtype=np.int64)
+        self.sims = np.full((n, self.capacity), -np.inf)
+
+    def update(self, rows, cols, tile, valid):
+        """Merge one tile (scores of rows x cols, masked by valid) into the candidate sets of `rows`"""
+        tile_cols = np.broadcast_to(cols, tile.shape)
+        merged_sims = np.concatenate([self.sims[rows], np.where(valid, tile, -np.inf)], axis=1)
+        merged_cols = np.concatenate([self.cols[rows], tile_cols], axis=1)
+
+        keep = np.argpartition(-merged_sims, self.capacity - 1, axis=1)[:, :self.capacity]
+        self.sims[rows] = np.take_along_axis(merged_sims, keep, axis=1)
+        self.cols[rows] = np.take_along_axis(merged_cols, keep, axis=1)
+
+    def row(self, i, threshold=-np.inf):
+        """Retained (cols, sims) of row i with score >= threshold, in column order"""
+        picked = np.flatnonzero((self.sims[i] >= threshold) & np.isfinite(self.sims[i]))
+        picked = picked[np.argsort(self.cols[i, picked])]
+        return self.cols[i, picked], self.sims[i, picked]
+
+    def incomplete_rows(self, threshold):
+        """Rows that may have dropped a score >= threshold"""
+        return np.flatnonzero(self.sims.min(axis=1) >= threshold)
+
+
+class IVFIndex:
+    """
+    Inverted-file index with a k-means coarse quantizer
+
+    Vectors are clustered into n_lists cells. The queries of one cell are
+    matched against the members of the n_probe cells whose centroids are
+    closest to that cell's centroid, so each cell costs
+    |cell| x |probed members| instead of |cell| x n.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, n_iter=10, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+
+    def _nearest(self, vectors, centroids, block_size=4096):
+        """Index of the nearest centroid for every vector"""
+        c_sq = np.einsum('ij,ij->i', centroids, centroids)
+        nearest = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_size):
+            chunk = vectors[start:start + block_size]
+            dist = c_sq[np.newaxis, :] - 2.0 * chunk @ centroids.T
+            nearest[start:start + block_size] = np.argmin(dist, axis=1)
+        return nearest
+
+    def fit(self, vectors):
+        """Cluster vectors with Lloyd's k-means and build the inverted lists"""
+        n = len(vectors)
+        n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+        rng = np.random.default_rng(self.seed)
+
+        centroids = vectors[rng.choice(n, n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = self._nearest(vectors, centroids)
+            counts = np.bincount(assign, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, vectors)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+
+        assign = self._nearest(vectors, centroids)
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(n_lists + 1))
+        self.centroids = centroids
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(n_lists)]
+        return self
+
+    def candidate_groups(self):
+        """Yield (queries, candidates) index arrays, one pair per non-empty cell"""
+        probes = self._probe_cells()
+        for cell, queries in enumerate(self.lists):
+            if len(queries) > 0:
+                yield queries, np.concatenate([self.lists[c] for c in probes[cell]])
+
+    def _probe_cells(self):
+        c_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        dist = c_sq[:, np.newaxis] + c_sq[np.newaxis, :] - 2.0 * self.centroids @ self.centroids.T
+        n_probe = min(self.n_probe, len(self.centroids))
+        return np.argsort(dist, axis=1)[:, :n_probe]
+
+
+def block_size_for_memory(max_memory_mb):
+    """Largest block size whose tile working set fits in max_memory_mb"""
+    tile_bytes = max_memory_mb * 1024 * 1024 / TILE_TEMPORARIES
+    return max(1, int(np.sqrt(tile_bytes / 8)))
+
+
+def make_neighbors(cols, sims, idx_to_material):
+    """Neighbor list sorted by similarity (ties keep index order)"""
+    neighbors = [
+        {'neighbor': idx_to_material[j], 'similarity': round(float(sim), 4)}
+        for j, sim in zip(cols, sims)
+    ]
     neighbors.sort(key=lambda x: x['similarity'], reverse=True)
-    formula_i = idx_to_material[i]
-    adjacency[formula_i] = neighbors
-    
-    if (i + 1) % max(1, n // 5) == 0:
-        print("  {}/{} done...".format(i + 1, n))
-
-print("[OK] Adjacency list created")
-
-# Auto-adjust threshold
-avg_neighbors = np.mean([len(neighbors) for neighbors in adjacency.values()])
-print("\n[Threshold] init=0.85, avg_neighbors={:.1f}".format(avg_neighbors))
-
-if avg_neighbors < 5:
-    all_sims = sorted(similarities)
-    target_idx = int(len(all_sims) * 0.8)
-    new_threshold = all_sims[max(0, min(target_idx, len(all_sims)-1))]
-    print("  -> Auto adjust: {:.4f}".format(new_threshold))
-    
-    # Recalculate
+    return neighbors
+
+
+def add_rows(adjacency, row_start, row_stop, edges, idx_to_material):
+    """Turn (edge_rows, edge_cols, edge_sims) chunks into neighbor lists of rows [row_start, row_stop)"""
+    edge_rows, edge_cols, edge_sims = (np.concatenate(part) for part in zip(*edges))
+    order = np.lexsort((edge_cols, edge_rows))
+    bounds = np.searchsorted(edge_rows[order], np.arange(row_start, row_stop + 1))
+
+    for i in range(row_start, row_stop):
+        picked = order[bounds[i - row_start]:bounds[i - row_start + 1]]
+        adjacency[idx_to_material[i]] = make_neighbors(edge_cols[picked], edge_sims[picked], idx_to_material)
+
+
+def build_adjacency(features, idx_to_material, threshold, block_size, quantile=None, candidates=None, symmetric=True,
+                    workers=1):
+    """
+    Build the adjacency list tile by tile
+
+    Only edges with similarity >= threshold are kept, so peak memory is
+    bounded by block_size x block_size rather than n x n.
+
+    Args:
+        quantile: optional StreamingQuantile fed with every off-diagonal score
+        candidates: optional RowCandidates fed with every tile
+        symmetric: score only tiles on or above the diagonal and mirror
+            them into the transposed rows (the metrics are symmetric)
+        workers: if > 1, shard row blocks across processes (see build_adjacency_parallel)
+    """
+    if workers > 1:
+        return build_adjacency_parallel(features, idx_to_material, threshold, block_size, workers, quantile, candidates)
+
+    n = len(features['normalized'])
+    adjacency = {}
+    # Edges scattered into row blocks that are not finalized yet
+    pending = {}
+
+    for row_start in range(0, n, block_size):
+        rows = slice(row_start, min(row_start + block_size, n))
+        edges = pending.pop(row_start, [])
+
+        for col_start in range(row_start if symmetric else 0, n, block_size):
+            cols = slice(col_start, min(col_start + block_size, n))
+            tile = hybrid_block(features, rows, cols)
+            mirrored = symmetric and col_start != row_start
+
+            off_diag = np.ones(tile.shape, dtype=bool)
+            if row_start == col_start:
+                np.fill_diagonal(off_diag, False)
+            if quantile is not None:
+                quantile.update(tile[off_diag], weight=2 if mirrored else 1)
+            if candidates is not None:
+                candidates.update(rows, np.arange(cols.start, cols.stop), tile, off_diag)
+                if mirrored:
+                    candidates.update(cols, np.arange(rows.start, rows.stop), tile.T, off_diag.T)
+
+            tile_rows, tile_cols = np.nonzero((tile >= threshold) & off_diag)
+            edge_rows = tile_rows + row_start
+            edge_cols = tile_cols + col_start
+            edge_sims = tile[tile_rows, tile_cols]
+            edges.append((edge_rows, edge_cols, edge_sims))
+            if mirrored:
+                pending.setdefault(col_start, []).append((edge_cols, edge_rows, edge_sims))
+
+        add_rows(adjacency, rows.start, rows.stop, edges, idx_to_material)
+        print("  {}/{} done...".format(rows.stop, n))
+
+    return adjacency
+
+
+# === Parallel build ===
+# Feature arrays are packed into one shared memory block that every worker
+# maps once, so tasks only carry row ranges.
+SHARED_COLUMNS = [('normalized', 4), ('unit', 4), ('band_gap', 1), ('density', 1)]
+
+_worker_shm = None
+_worker_features = None
+
+
+def share_features(features):
+    """Copy the feature arrays into a new shared memory block"""
+    packed = np.column_stack([features[name].reshape(len(features['normalized']), width)
+                              for name, width in SHARED_COLUMNS])
+    shm = shared_memory.SharedMemory(create=True, size=max(1, packed.nbytes))
+    np.ndarray(packed.shape, dtype=packed.dtype, buffer=shm.buf)[:] = packed
+    return shm, packed.shape
+
+
+def unpack_features(packed):
+    """Feature dict of column views into a packed array"""
+    features = {}
+    col = 0
+    for name, width in SHARED_COLUMNS:
+        features[name] = packed[:, col:col + width] if width > 1 else packed[:, col]
+        col += width
+    return features
+
+
+def _init_worker(shm_name, shape):
+    global _worker_shm, _worker_features
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_features = unpack_features(np.ndarray(shape, dtype=float, buffer=_worker_shm.buf))
+
+
+def _score_rows(row_start, row_stop, threshold, block_size, bins, capacity):
+    """Worker task: score rows [row_start, row_stop) against every column"""
+    features = _worker_features
+    n = len(features['normalized'])
+    rows = slice(row_start, row_stop)
+    local_rows = slice(0, row_stop - row_start)
+    quantile = StreamingQuantile(bins=bins) if bins else None
+    candidates = RowCandidates(row_stop - row_start, capacity, n_cols=n) if capacity else None
+    edges = []
+
+    for col_start in range(0, n, block_size):
+        cols = slice(col_start, min(col_start + block_size, n))
+        tile = hybrid_block(features, rows, cols)
+
+        off_diag = np.ones(tile.shape, dtype=bool)
+        diag = np.arange(max(row_start, col_start), min(row_stop, cols.stop))
+        off_diag[diag - row_start, diag - col_start] = False
+        if quantile is not None:
+            quantile.update(tile[off_diag])
+        if candidates is not None:
+            candidates.update(local_rows, np.arange(cols.start, cols.stop), tile, off_diag)
+
+        tile_rows, tile_cols = np.nonzero((tile >= threshold) & off_diag)
+        edges.append((tile_rows + row_start, tile_cols + col_start, tile[tile_rows, tile_cols]))
+
+    return {
+        'edges': edges,
+        'counts': quantile.counts if quantile is not None else None,
+        'candidates': (candidates.cols, candidates.sims) if candidates is not None else None,
+    }
+
+
+def build_adjacency_parallel(features, idx_to_material, threshold, block_size, workers, quantile=None, candidates=None):
+    """
+    build_adjacency across a ProcessPoolExecutor
+
+    Each task owns one row block and scores it against every column, so
+    shards never exchange edges and merging is concatenation in row order.
+    Symmetric halving is not used here: it would scatter every tile into
+    rows owned by other shards.
+    """
+    n = len(features['normalized'])
+    bins = quantile.bins if quantile is not None else 0
+    capacity = candidates.capacity if candidates is not None else 0
+    shm, shape = share_features(features)
+    adjacency = {}
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shm.name, shape)) as pool:
+            starts = list(range(0, n, block_size))
+            futures = [pool.submit(_score_rows, start, min(start + block_size, n), threshold, block_size, bins, capacity)
+                       for start in starts]
+
+            for start, future in zip(starts, futures):
+                stop = min(start + block_size, n)
+                result = future.result()
+                if quantile is not None:
+                    quantile.counts += result['counts']
+                if candidates is not None:
+                    candidates.cols[start:stop], candidates.sims[start:stop] = result['candidates']
+                add_rows(adjacency, start, stop, result['edges'], idx_to_material)
+                print("  {}/{} done...".format(stop, n))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return adjacency
+
+
+def row_tiles(features, rows, n, block_size):
+    """
+    Score rows (an index array) against every column, block_size columns at
+    a time, so a tile stays len(rows) x block_size
+
+    Yields:
+        (column indices, tile) with the self pairs set to -inf
+    """
+    for col_start in range(0, n, block_size):
+        cols = np.arange(col_start, min(col_start + block_size, n))
+        tile = hybrid_block(features, rows, slice(cols[0], cols[-1] + 1))
+        tile[rows[:, np.newaxis] == cols[np.newaxis, :]] = -np.inf
+        yield cols, tile
+
+
+def group_rows(edges, n_rows):
+    """
+    Split (local row, col, sim) chunks, given in column order, into
+    per-row (cols, sims) for local rows 0 .. n_rows - 1, keeping column order
+    """
+    if not edges:
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+        return [empty] * n_rows
+    edge_rows, edge_cols, edge_sims = (np.concatenate(part) for part in zip(*edges))
+    # A stable sort by row keeps the column order within each row
+    order = np.argsort(edge_rows, kind='stable')
+    bounds = np.searchsorted(edge_rows[order], np.arange(n_rows + 1))
+    return [(edge_cols[order[bounds[r]:bounds[r + 1]]], edge_sims[order[bounds[r]:bounds[r + 1]]])
+            for r in range(n_rows)]
+
+
+def adjacency_from_candidates(features, idx_to_material, candidates, threshold, block_size):
+    """
+    Adjacency list for threshold from retained candidates
+
+    Rows whose candidate set may be missing edges are rescored against all
+    columns in block_size x block_size tiles.
+
+    Returns:
+        (adjacency, number of rescored rows)
+    """
+    n = len(features['normalized'])
+    rescore = candidates.incomplete_rows(threshold)
+    rescored = {}
+
+    for start in range(0, len(rescore), block_size):
+        rows = rescore[start:start + block_size]
+        edges = []
+        for cols, tile in row_tiles(features, rows, n, block_size):
+            tile_rows, tile_cols = np.nonzero(tile >= threshold)
+            edges.append((tile_rows, cols[tile_cols], tile[tile_rows, tile_cols]))
+        rescored.update(zip(rows.tolist(), group_rows(edges, len(rows))))
+
     adjacency = {}
     for i in range(n):
-        neighbors = []
-        for j in range(n):
-            if i != j:
-                sim = hybrid_sim(i, j)
-                if sim >= new_threshold:
-                    neighbors.append({
-                        'neighbor': idx_to_material[j],
-                        'similarity': round(sim, 4)
-                    })
-        neighbors.sort(key=lambda x: x['similarity'], reverse=True)
-        adjacency[idx_to_material[i]] = neighbors
-
-# === 4. Save ===
-with open('adjacency_list.json', 'w', encoding='utf-8') as f:
-    json.dump(adjacency, f, indent=2, ensure_ascii=False)
-
-print("[OK] Adjacency list saved: adjacency_list.json")
-
-# === 5. Statistics ===
-print("\n" + "=" * 70)
-print("Graph Statistics")
-print("=" * 70)
-num_nodes = len(adjacency)
-num_edges = sum(len(neighbors) for neighbors in adjacency.values())
-avg_degree = num_edges / num_nodes if num_nodes > 0 else 0
-
-print("Nodes (Materials): {}".format(num_nodes))
-print("Edges (Connections): {}".format(num_edges))
-print("Avg Degree: {:.2f}".format(avg_degree))
-
-# Sample output
-print("\n" + "=" * 70)
-print("Sample Adjacency List")
-print("=" * 70)
-for i, (formula, neighbors) in enumerate(list(adjacency.items())[:3]):
-    print("\n{}:".format(formula))
-    for neighbor in neighbors[:3]:
-        print("  -> {}: {}".format(neighbor['neighbor'], neighbor['similarity']))
-    if len(neighbors) > 3:
-        print("  ... and {} more".format(len(neighbors) - 3))
-
-print("\n[OK] Complete! Next: python 3_recommend.py")
+        cols, sims = rescored[i] if i in rescored else candidates.row(i, threshold)
+        adjacency[idx_to_material[i]] = make_neighbors(cols, sims, idx_to_material)
+
+    return adjacency, len(rescore)
+
+
+def build_knn_adjacency(features, idx_to_material, k, block_size, symmetric=True, workers=1):
+    """Adjacency list keeping exactly the k best neighbors of every node (kNN graph)"""
+    n = len(features['normalized'])
+    candidates = RowCandidates(n, k)
+    build_adjacency(features, idx_to_material, np.inf, block_size, candidates=candidates, symmetric=symmetric,
+                    workers=workers)
+    return {idx_to_material[i]: make_neighbors(*candidates.row(i), idx_to_material) for i in range(n)}
+
+
+def build_ann_knn_adjacency(features, idx_to_material, k, block_size, index):
+    """
+    Approximate kNN graph: candidates proposed by an IVFIndex over the
+    weighted normalized features, then re-scored with the exact hybrid formula
+    """
+    n = len(features['normalized'])
+    weights = np.sqrt([FEATURE_WEIGHTS[feature] for feature in IMPORTANT_FEATURES])
+    index.fit(features['normalized'] * weights)
+
+    candidates = RowCandidates(n, k)
+    for queries, pool in index.candidate_groups():
+        for start in range(0, len(queries), block_size):
+            rows = queries[start:start + block_size]
+            tile = hybrid_block(features, rows, pool)
+            candidates.update(rows, pool, tile, rows[:, np.newaxis] != pool[np.newaxis, :])
+
+    return {idx_to_material[i]: make_neighbors(*candidates.row(i), idx_to_material) for i in range(n)}
+
+
+def build_threshold_adjacency(features, idx_to_material, threshold, block_size, capacity=0, symmetric=True,
+                              workers=1):
+    """
+    Threshold graph with the auto-adjust rule: if fewer than 5 neighbors
+    per node pass threshold, the 80th percentile of all scores is used instead
+
+    Args:
+        capacity: per-row candidates kept for re-thresholding (0 = second pass).
+            They take n x capacity x 16 bytes on top of the tiles, so they
+            are opt-in and only worth it when auto-adjust is expected.
+
+    Returns:
+        (adjacency, threshold actually applied)
+    """
+    print("\n[Similarity] Calculating (block size {})...".format(block_size))
+    n = len(features['normalized'])
+    candidates = RowCandidates(n, capacity) if capacity else None
+
+    quantile = StreamingQuantile()
+    adjacency = build_adjacency(features, idx_to_material, threshold, block_size, quantile, candidates,
+                                symmetric=symmetric, workers=workers)
+    print("[OK] Adjacency list created")
+
+    # Auto-adjust threshold
+    avg_neighbors = np.mean([len(neighbors) for neighbors in adjacency.values()])
+    print("\n[Threshold] init={}, avg_neighbors={:.1f}".format(threshold, avg_neighbors))
+
+    if avg_neighbors < 5:
+        threshold = new_threshold = quantile.quantile(AUTO_THRESHOLD_QUANTILE)
+        print("  -> Auto adjust: {:.4f}".format(new_threshold))
+
+        if candidates is not None:
+            adjacency, rescored = adjacency_from_candidates(features, idx_to_material, candidates, new_threshold, block_size)
+            print("  -> Rebuilt from candidates ({} rows rescored)".format(rescored))
+        else:
+            # Recalculate
+            adjacency = build_adjacency(features, idx_to_material, new_threshold, block_size,
+                                        symmetric=symmetric, workers=workers)
+
+    return adjacency, threshold
+
+
+def insert_neighbor(neighbors, neighbor, limit=None):
+    """
+    Insert into a neighbor list sorted by similarity, after equal scores
+    (as a rebuild would order a higher index). With limit, the list is
+    truncated back to limit entries and the dropped entry is returned.
+    """
+    neighbors.insert(bisect.bisect_right(neighbors, -neighbor['similarity'], key=lambda x: -x['similarity']), neighbor)
+    if limit is not None and len(neighbors) > limit:
+        return neighbors.pop()
+    return None
+
+
+class SimilarityGraphBuilder:
+    """
+    Material similarity graph builder
+
+    fit() extracts and normalizes features once; build() can then be
+    called repeatedly with different thresholds or modes without reloading.
+    update() adds materials to a built graph by scoring only the new rows.
+
+    Example:
+        builder = SimilarityGraphBuilder(block_size=512)
+        builder.fit(load_materials('battery_cathodes.json'))
+        builder.build(knn=10)
+        builder.save('adjacency_list.json')
+    """
+
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE, symmetric=True, workers=1):
+        """
+        Initialize
+
+        Args:
+            block_size: tile size for similarity blocks
+            symmetric: score each unordered pair once
+            workers: processes for exact builds
+        """
+        self.block_size = block_size
+        self.symmetric = symmetric
+        self.workers = workers
+        self.materials = []
+        self.idx_to_material = {}
+        self.feature_matrix = None
+        self.scaler = None
+        self.features = None
+        self.adjacency = {}
+        # Graph mode of the last build, used by update()
+        self.threshold = None
+        self.knn = None
+        self.build_params = {}
+
+    def fit(self, materials):
+        """Extract and normalize the features of materials"""
+        feature_matrix, valid_materials, idx_to_material = extract_features(materials)
+        if len(feature_matrix) == 0:
+            raise ValueError("No valid data")
+
+        self.materials = valid_materials
+        self.idx_to_material = idx_to_material
+        self.feature_matrix = feature_matrix
+        self.scaler = MinMaxScaler().fit(feature_matrix)
+        self.features = prepare_features(feature_matrix, self.scaler)
+        return self
+
+    def build(self, threshold=DEFAULT_THRESHOLD, knn=None, ann=None, candidates=0):
+        """
+        Build the adjacency list
+
+        Args:
+            threshold: initial threshold (auto-adjusted when too sparse)
+            knn: keep the knn best neighbors per material instead of thresholding
+            ann: optional IVFIndex proposing candidates for knn
+            candidates: per-row candidates kept for re-thresholding (0 = second pass)
+
+        Returns:
+            {formula: [{'neighbor': ..., 'similarity': ...}, ...]}
+        """
+        if self.features is None:
+            raise RuntimeError("fit() must be called before build()")
+        if ann is not None and not knn:
+            raise ValueError("ann requires knn")
+        self.build_params = {'threshold': threshold, 'knn': knn, 'ann': ann, 'candidates': candidates}
+        self.knn = knn
+        self.threshold = None
+
+        if knn:
+            print("\n[Similarity] Calculating {}-nearest neighbors (block size {})...".format(knn, self.block_size))
+            if ann is not None:
+                self.adjacency = build_ann_knn_adjacency(self.features, self.idx_to_material, knn, self.block_size, ann)
+            else:
+                self.adjacency = build_knn_adjacency(self.features, self.idx_to_material, knn, self.block_size,
+                                                     symmetric=self.symmetric, workers=self.workers)
+            print("[OK] kNN adjacency list created")
+        else:
+            self.adjacency, self.threshold = build_threshold_adjacency(
+                self.features, self.idx_to_material, threshold, self.block_size,
+                candidates, symmetric=self.symmetric, workers=self.workers)
+        return self.adjacency
+
+    def graph_params(self):
+        """Parameters saved with the graph so that load() can restore the graph mode"""
+        ann = self.build_params.get('ann')
+        if ann is not None:
+            ann = {'n_lists': ann.n_lists, 'n_probe': ann.n_probe, 'n_iter': ann.n_iter, 'seed': ann.seed}
+        return {'threshold': self.threshold, 'knn': self.knn, 'build': dict(self.build_params, ann=ann)}
+
+    def load(self, path, threshold=None, knn=None):
+        """
+        Attach a previously saved graph (CSR or JSON) built from the fitted materials
+
+        The applied threshold or K and the build() parameters are read from
+        the graph file (see graph_params()); the arguments override them.
+
+        Args:
+            threshold: threshold the graph was built with
+                (default: stored one, else the smallest stored similarity)
+            knn: K if the graph is a kNN graph (default: stored one)
+        """
+        stored = None
+        if is_csr_file(path):
+            graph = load_csr(path)
+            self.adjacency = graph.to_adjacency()
+            stored = graph.params
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.adjacency = json.load(f)
+            if os.path.exists(path + PARAMS_SUFFIX):
+                with open(path + PARAMS_SUFFIX, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+        stored = stored or {}
+
+        if knn is None:
+            knn = stored.get('knn')
+        if threshold is None and not knn:
+            threshold = stored.get('threshold')
+
+        build = stored.get('build')
+        if build:
+            ann = IVFIndex(**build['ann']) if build.get('ann') else None
+            self.build_params = dict(build, knn=knn, ann=ann if knn else None)
+        else:
+            self.build_params = {'threshold': threshold or DEFAULT_THRESHOLD, 'knn': knn, 'ann': None, 'candidates': 0}
+        self.knn = knn
+        self.threshold = None
+        if not knn:
+            if threshold is None:
+                scores = [neighbor['similarity'] for neighbors in self.adjacency.values() for neighbor in neighbors]
+                threshold = min(scores) if scores else DEFAULT_THRESHOLD
+                print("[Update] No build threshold stored in {}; using the smallest similarity {}".format(path, threshold))
+            self.threshold = threshold
+        return self.adjacency
+
+    def update(self, new_materials, fixed_scale=False):
+        """
+        Add materials to the built graph, scoring only the new rows (O(k x n))
+
+        Old scores stay valid only while the MinMaxScaler range is unchanged.
+        If a new material falls outside it, the graph is rebuilt with the
+        last build() parameters, unless fixed_scale keeps the old range (new
+        rows are then normalized with it and may fall outside [0, 1]).
+
+        In threshold mode the threshold applied by the last build is kept;
+        it is not re-estimated.
+
+        Returns:
+            number of materials added
+        """
+        if self.features is None:
+            raise RuntimeError("fit() and build() must be called before update()")
+
+        known_ids = {mat.get('material_id', 'unknown') for mat in self.materials}
+        new_materials = [mat for mat in new_materials if mat.get('material_id', 'unknown') not in known_ids]
+        new_matrix, new_valid, _ = extract_features(new_materials)
+        if len(new_matrix) == 0:
+            return 0
+
+        feature_matrix = np.vstack([self.feature_matrix, new_matrix])
+        range_changed = (np.any(new_matrix < self.scaler.data_min_) or np.any(new_matrix > self.scaler.data_max_))
+        if range_changed and not fixed_scale:
+            print("[Update] Feature range changed -> full rebuild")
+            self.fit(list(self.materials) + new_valid)
+            self.build(**self.build_params)
+            return len(new_valid)
+
+        n_old = len(self.feature_matrix)
+        n = len(feature_matrix)
+        for offset, mat in enumerate(new_valid):
+            self.idx_to_material[n_old + offset] = mat.get('formula', 'Material_{}'.format(n_old + offset))
+        self.materials = list(self.materials) + new_valid
+        self.feature_matrix = feature_matrix
+        self.features = prepare_features(feature_matrix, self.scaler)
+
+        # Lists in the dict belong to the last row with each formula
+        owner = {formula: idx for idx, formula in self.idx_to_material.items()}
+        old_rows = [j for j in range(n_old) if owner[self.idx_to_material[j]] == j]
+        if self.knn:
+            # Score an old row's list must beat to take in a new neighbor
+            entry = np.full(n_old, np.inf)
+            for j in old_rows:
+                neighbors = self.adjacency[self.idx_to_material[j]]
+                entry[j] = neighbors[-1]['similarity'] if len(neighbors) >= self.knn else -np.inf
+        else:
+            entry = np.full(n_old, np.inf)
+            entry[old_rows] = self.threshold
+
+        # kNN rows whose cut-off falls between scores equal at the stored 4-decimal precision
+        recheck = set()
+        print("[Update] Scoring {} new materials against {}...".format(n - n_old, n))
+        for start in range(n_old, n, self.block_size):
+            rows = np.arange(start, min(start + self.block_size, n))
+            local_rows = np.arange(len(rows))
+            candidates = RowCandidates(len(rows), self.knn, n_cols=n) if self.knn else None
+            edges = []
+            # Old rows each new row may enter, by the entry scores at the start of the block
+            # (they only rise, so this is a superset; the insert below re-checks)
+            scatter = []
+
+            for cols, tile in row_tiles(self.features, rows, n, self.block_size):
+                if candidates is not None:
+                    candidates.update(local_rows, cols, tile, np.isfinite(tile))
+                else:
+                    tile_rows, tile_cols = np.nonzero(tile >= self.threshold)
+                    edges.append((tile_rows, cols[tile_cols], tile[tile_rows, tile_cols]))
+                old = cols < n_old
+                if old.any():
+                    old_tile = tile[:, old]
+                    tile_rows, tile_cols = np.nonzero(old_tile >= entry[cols[old]] - 1e-4)
+                    scatter.append((tile_rows, cols[old][tile_cols], old_tile[tile_rows, tile_cols]))
+
+            own = group_rows(edges, len(rows)) if candidates is None else None
+            targets = group_rows(scatter, len(rows))
+            for local, i in enumerate(rows.tolist()):
+                cols, sims = candidates.row(local) if candidates is not None else own[local]
+                name_i = self.idx_to_material[i]
+                self.adjacency[name_i] = make_neighbors(cols, sims, self.idx_to_material)
+
+                # Scatter i into the old rows it qualifies for
+                for j, sim in zip(*targets[local]):
+                    neighbors = self.adjacency[self.idx_to_material[j]]
+                    neighbor = {'neighbor': name_i, 'similarity': round(float(sim), 4)}
+                    if self.knn:
+                        if len(neighbors) >= self.knn and neighbor['similarity'] <= neighbors[-1]['similarity']:
+                            if neighbor['similarity'] == neighbors[-1]['similarity']:
+                                recheck.add(j)
+                            continue
+                        dropped = insert_neighbor(neighbors, neighbor, self.knn)
+                        if dropped is not None and dropped['similarity'] == neighbors[-1]['similarity']:
+                            recheck.add(j)
+                        if len(neighbors) >= self.knn:
+                            entry[j] = neighbors[-1]['similarity']
+                    elif sim >= self.threshold:
+                        insert_neighbor(neighbors, neighbor)
+
+        # Rounded scores cannot tell which side of the cut-off a tie falls on; rescore those rows exactly
+        recheck = np.array(sorted(recheck), dtype=np.int64)
+        for start in range(0, len(recheck), self.block_size):
+            rows = recheck[start:start + self.block_size]
+            candidates = RowCandidates(len(rows), self.knn, n_cols=n)
+            for cols, tile in row_tiles(self.features, rows, n, self.block_size):
+                candidates.update(np.arange(len(rows)), cols, tile, np.isfinite(tile))
+            for local, j in enumerate(rows.tolist()):
+                self.adjacency[self.idx_to_material[j]] = make_neighbors(*candidates.row(local), self.idx_to_material)
+
+        return n - n_old
+
+    def save(self, path=DEFAULT_OUTPUTS['csr'], format='csr', score_dtype='float32'):
+        """
+        Save the graph
+
+        Args:
+            format: 'csr' (binary, see graph_store.py) or 'json' (indented
+                adjacency list, build parameters in path + PARAMS_SUFFIX)
+            score_dtype: CSR score type, 'float32' or 'float16'
+        """
+        if format == 'csr':
+            save_csr(CSRGraph.from_adjacency(self.adjacency, score_dtype, self.graph_params()), path)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.adjacency, f, indent=2, ensure_ascii=False)
+            with open(path + PARAMS_SUFFIX, 'w', encoding='utf-8') as f:
+                json.dump(self.graph_params(), f, indent=2)
+
+    def print_statistics(self):
+        """Print graph statistics and a sample of the adjacency list"""
+        adjacency = self.adjacency
+
+        print("\n" + "=" * 70)
+        print("Graph Statistics")
+        print("=" * 70)
+        num_nodes = len(adjacency)
+        num_edges = sum(len(neighbors) for neighbors in adjacency.values())
+        avg_degree = num_edges / num_nodes if num_nodes > 0 else 0
+
+        print("Nodes (Materials): {}".format(num_nodes))
+        print("Edges (Connections): {}".format(num_edges))
+        print("Avg Degree: {:.2f}".format(avg_degree))
+
+        # Sample output
+        print("\n" + "=" * 70)
+        print("Sample Adjacency List")
+        print("=" * 70)
+        for formula, neighbors in list(adjacency.items())[:3]:
+            print("\n{}:".format(formula))
+            for neighbor in neighbors[:3]:
+                print("  -> {}: {}".format(neighbor['neighbor'], neighbor['similarity']))
+            if len(neighbors) > 3:
+                print("  ... and {} more".format(len(neighbors) - 3))
+
+
+def add_materials(builder, args):
+    """--add: update the saved graph with new materials and record them in --input; returns the count added"""
+    if not os.path.exists(args.output):
+        print("[ERROR] Graph file not found: {}".format(args.output))
+        sys.exit(1)
+
+    builder.load(args.output, knn=args.knn)
+    new_materials = load_materials(args.add)
+    added = builder.update(new_materials, fixed_scale=args.fixed_scale)
+    print("[OK] {} new materials added".format(added))
+
+    if added and is_store(args.input):
+        known_ids = set(open_store(args.input).strings['material_id'])
+        fresh = [mat for mat in new_materials if mat.get('material_id', 'unknown') not in known_ids]
+        append_store(args.input, fresh)
+        print("[OK] Materials appended to {}".format(args.input))
+    elif added:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        known_ids = {mat.get('material_id', 'unknown') for mat in load_materials(args.input)}
+        fresh = [mat for mat in new_materials if mat.get('material_id', 'unknown') not in known_ids]
+        if isinstance(data, dict):
+            data.setdefault('General', []).extend(fresh)
+        else:
+            data.extend(fresh)
+        with open(args.input, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        print("[OK] Materials appended to {}".format(args.input))
+    return added
+
+
+def graph_files(args):
+    """Files a build writes: the graph, plus the parameter file of a JSON graph"""
+    return [args.output] if args.format == 'csr' else [args.output, args.output + PARAMS_SUFFIX]
+
+
+def graph_cache_key(cache, args):
+    """Stage cache key of a graph build: input content, build options and the weights"""
+    params = {
+        'format': args.format,
+        'score_dtype': args.score_dtype,
+        'threshold': args.threshold,
+        'symmetric': not args.no_symmetry,
+        'candidates': args.candidates,
+        'knn': args.knn,
+        'ann': args.ann,
+        'ann_lists': args.ann_lists,
+        'ann_probe': args.ann_probe,
+        'important_features': IMPORTANT_FEATURES,
+        'feature_weights': FEATURE_WEIGHTS,
+        'similarity_weights': SIMILARITY_WEIGHTS,
+        'auto_threshold_quantile': AUTO_THRESHOLD_QUANTILE,
+        'quantile_bins': QUANTILE_BINS,
+    }
+    return cache.key('processing', STAGE_SOURCES, [args.input], params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Battery Cathode Material - Preprocessing & Similarity')
+    parser.add_argument('--input', help='Material data: store directory or JSON (default: battery_cathodes.store, then battery_cathodes.json)')
+    parser.add_argument('--output', help='Graph output path (default: adjacency_graph.csr, or adjacency_list.json with --format json)')
+    parser.add_argument('--format', choices=['csr', 'json'], default='csr', help='Graph file format (default: csr)')
+    parser.add_argument('--score-dtype', choices=['float32', 'float16'], default='float32', help='CSR score precision (default: float32)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Initial similarity threshold (default: 0.85)')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE, help='Tile size for similarity blocks (default: 1024)')
+    parser.add_argument('--max-memory-mb', type=float, help='Memory ceiling per tile; overrides --block-size')
+    parser.add_argument('--no-symmetry', action='store_true', help='Score every ordered pair instead of the upper triangle only')
+    parser.add_argument('--candidates', type=int, default=0, help='Per-row candidates kept for re-thresholding without a second pass '
+                                                                  '(default: 0 = second pass; costs n x N x 16 bytes)')
+    parser.add_argument('--knn', type=int, metavar='K', help='Keep the K most similar neighbors per material instead of thresholding')
+    parser.add_argument('--ann', choices=['ivf'], help='Approximate candidate search for --knn (IVF with k-means)')
+    parser.add_argument('--ann-lists', type=int, help='IVF cells (default: sqrt(n))')
+    parser.add_argument('--ann-probe', type=int, default=8, help='IVF cells probed per query cell (default: 8)')
+    parser.add_argument('--workers', type=int, default=1, help='Processes for exact similarity builds (default: 1)')
+    parser.add_argument('--add', metavar='PATH', help='Add the materials in PATH to the existing --output graph incrementally')
+    parser.add_argument('--fixed-scale', action='store_true', help='With --add, keep the old normalization range instead of rebuilding')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Stage cache directory (default: .stage_cache)')
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_MB, help='Stage cache size bound (default: 1024)')
+    parser.add_argument('--no-cache', action='store_true', help='Always rebuild and do not cache the graph')
+    parser.add_argument('--metrics', metavar='PATH', help='Write per-stage time/memory/throughput metrics as JSON')
+    parser.add_argument('--trace-malloc', action='store_true', help='Also record peak allocations with tracemalloc (slower)')
+    parser.add_argument('--profile', action='store_true', help='Profile the graph build (or --add) with cProfile')
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = DEFAULT_OUTPUTS[args.format]
+    if args.input is None:
+        args.input = next((path for path in DEFAULT_INPUTS if os.path.exists(path)), DEFAULT_INPUTS[-1])
+    if args.ann and not args.knn:
+        parser.error('--ann requires --knn')
+    if args.ann and args.workers > 1:
+        parser.error('--workers applies to exact builds only')
+
+    # The graph build (or the incremental update with --add) is where the time goes
+    metrics = Instrumentation('2_processing', trace_malloc=args.trace_malloc,
+                              profile=('add' if args.add else 'build') if args.profile else None)
+    try:
+        process(args, metrics)
+    finally:
+        if args.metrics:
+            metrics.write(args.metrics)
+            print("[OK] Metrics saved: {}".format(args.metrics))
+
+
+def process(args, metrics):
+    """Run the stages of main() under metrics"""
+    print("=" * 70)
+    print("Battery Cathode Material - Preprocessing & Similarity")
+    print("=" * 70)
+
+    # Incremental --add edits the graph in place, so it is never served from the cache
+    cache = key = None
+    if not args.no_cache and not args.add:
+        with metrics.stage('cache') as record:
+            cache = StageCache(args.cache_dir, int(args.cache_max_mb * (1 << 20)))
+            key = graph_cache_key(cache, args)
+            record['hit'] = cache.restore(key, graph_files(args))
+        if record['hit']:
+            print("[OK] Inputs unchanged, graph taken from the stage cache: {} (key {})".format(args.output, key[:12]))
+            print("\n[OK] Complete! Next: python 3_recommend.py")
+            return
+
+    with metrics.stage('load') as record:
+        materials = load_materials(args.input)
+        record['rows'] = len(materials)
+    print("[OK] {} unique materials loaded".format(len(materials)))
+
+    block_size = args.block_size
+    if args.max_memory_mb:
+        block_size = block_size_for_memory(args.max_memory_mb)
+    builder = SimilarityGraphBuilder(block_size=block_size, symmetric=not args.no_symmetry, workers=args.workers)
+
+    print("\n[Preprocessing] Feature extraction & normalization...")
+    try:
+        with metrics.stage('normalize', rows=len(materials)):
+            builder.fit(materials)
+    except ValueError:
+        print("[ERROR] No valid data")
+        sys.exit(1)
+    print("[OK] {} materials used".format(len(builder.materials)))
+    print("[OK] {} materials normalized".format(len(builder.features['normalized'])))
+
+    n = len(builder.features['normalized'])
+    if args.add:
+        with metrics.stage('add') as record:
+            record['rows'] = add_materials(builder, args)
+    else:
+        ann = IVFIndex(n_lists=args.ann_lists, n_probe=args.ann_probe) if args.ann else None
+        # Pairs of the exact first pass; IVF scores only its candidates, and
+        # the parallel build scores every ordered pair (no symmetric halving)
+        pairs = None if ann else (n * (n - 1) // 2 if builder.symmetric and builder.workers <= 1 else n * n)
+        with metrics.stage('build', rows=n, pairs=pairs) as record:
+            builder.build(threshold=args.threshold, knn=args.knn, ann=ann, candidates=args.candidates)
+            record['edges'] = sum(len(neighbors) for neighbors in builder.adjacency.values())
+
+    with metrics.stage('save', rows=len(builder.adjacency)):
+        builder.save(args.output, format=args.format, score_dtype=args.score_dtype)
+    print("[OK] Graph saved: {} ({})".format(args.output, args.format))
+    if cache is not None:
+        with metrics.stage('cache_store'):
+            cache.store(key, 'processing', graph_files(args))
+        print("[OK] Graph cached (key {})".format(key[:12]))
+
+    builder.print_statistics()
+
+    print("\n[OK] Complete! Next: python 3_recommend.py")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,36 +6,299 @@ Usage:
   python 3_recommend.py LiCoO2 -k 10           # Top 10
   python 3_recommend.py --list                 # List all materials
   python 3_recommend.py --interactive          # Interactive mode
+  python 3_recommend.py --targets LiCoO2:2 LiNiO2   # Substitutes for a group
+  python 3_recommend.py LiCoO2 --where "density < 4 and band_gap > 2"
+  python 3_recommend.py --complete LiNi0.5     # Names starting with a prefix
+  python 3_recommend.py --serve                # Serve queries with a warm graph
+  python 3_recommend.py --connect LiCoO2       # Query a running server
+  python 3_recommend.py --batch targets.txt    # Many targets, JSON Lines out
 """
 
+import asyncio
+import contextlib
+import csv
+import heapq
 import json
 import os
 import argparse
+import socket
+import struct
 import sys
-from typing import List, Tuple, Dict
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Iterable, Iterator, List, TextIO, Tuple, Dict
+
+import numpy as np
+
+from graph_store import CSRAdjacency, CSRGraph, is_csr_file, load_csr, open_csr
+from instrumentation import Instrumentation
+from name_index import NameIndex
+from property_index import MaterialProperties, parse_constraints
+
+# Candidates when --graph is not given; the most recently written one is used
+DEFAULT_GRAPH_PATHS = ['adjacency_graph.csr', 'adjacency_list.json']
+# Material properties for --where constraints, looked up in order when --data is not given
+DEFAULT_DATA_PATHS = ['battery_cathodes.store', 'battery_cathodes.json']
+# Constraint node masks kept per recommender
+MASK_CACHE_SIZE = 32
+# Query results kept per recommender (0 disables the cache)
+DEFAULT_CACHE_SIZE = 1024
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Recommendation strategies: direct neighbors, multi-hop BFS, personalized PageRank
+STRATEGIES = ['direct', 'bfs', 'ppr']
+DEFAULT_MAX_HOPS = 2
+BFS_BEAM = 64
+PPR_ALPHA = 0.15
+PPR_EPSILON = 1e-5
+DEFAULT_TIME_BUDGET_MS = 200
+
+
+def multi_hop_scores(graph: CSRGraph, source: int, top_k: int, max_hops: int = DEFAULT_MAX_HOPS,
+                     beam: int = BFS_BEAM, deadline: float = None, allowed: np.ndarray = None) -> Dict[int, float]:
+    """
+    Bounded BFS from source; a node scores the best product of edge
+    similarities over paths of at most max_hops edges
+    
+    Only the `beam` best nodes reached in a hop are expanded. Path scores
+    only shrink, so the walk stops once no frontier node can beat the
+    current top_k-th score, or when the deadline (perf_counter) passes.
+    With an `allowed` node mask only allowed nodes count toward that score
+    (all reached nodes are still returned and walked through).
+    """
+    best = {source: 1.0}
+    frontier = [(1.0, source)]
+    
+    for _ in range(max_hops):
+        reached = {}
+        for score, node in frontier:
+            cols, sims = graph.edges(node)
+            for j, sim in zip(cols.tolist(), sims.tolist()):
+                path_score = score * sim
+                if path_score > best.get(j, 0.0):
+                    best[j] = path_score
+                    reached[j] = path_score
+            if deadline is not None and time.perf_counter() > deadline:
+                return best
+        
+        if not reached:
+            break
+        frontier = heapq.nlargest(beam, ((score, node) for node, score in reached.items()))
+        leaders = heapq.nlargest(top_k, (score for node, score in best.items()
+                                         if node != source and (allowed is None or allowed[node])))
+        if len(leaders) == top_k and frontier[0][0] <= leaders[-1]:
+            break
+    
+    return best
+
+
+def personalized_pagerank(graph: CSRGraph, source: int, alpha: float = PPR_ALPHA, epsilon: float = PPR_EPSILON,
+                          deadline: float = None) -> Dict[int, float]:
+    """
+    Personalized PageRank seeded at source, by local forward push
+    
+    Walk probabilities follow edge similarity; with probability alpha the
+    walk restarts at source. Residual mass is pushed only from nodes
+    holding more than epsilon, so at most 1 / (alpha x epsilon) pushes run
+    whatever the graph size, and fewer if the deadline (perf_counter) passes.
+    """
+    estimate = {}
+    residual = {source: 1.0}
+    queue = deque([source])
+    queued = {source}
+    
+    while queue:
+        node = queue.popleft()
+        queued.discard(node)
+        mass = residual.pop(node, 0.0)
+        cols, sims = graph.edges(node)
+        total = float(sims.sum())
+        
+        if total <= 0:
+            estimate[node] = estimate.get(node, 0.0) + mass
+            continue
+        
+        estimate[node] = estimate.get(node, 0.0) + alpha * mass
+        spread = (1.0 - alpha) * mass / total
+        for j, sim in zip(cols.tolist(), sims.tolist()):
+            residual[j] = residual.get(j, 0.0) + spread * sim
+            if residual[j] > epsilon and j not in queued:
+                queue.append(j)
+                queued.add(j)
+        
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+    
+    return estimate
+
+
+def filtered_neighbors(graph: CSRGraph, node: int, top_k: int, allowed: np.ndarray) -> List[Tuple[int, float]]:
+    """
+    First top_k allowed neighbors of a node, in stored (similarity) order
+    
+    The row is scanned in growing chunks, going past top_k entries only as
+    far as needed to find top_k that pass, so a memory-mapped row is read
+    no further than that.
+    """
+    start, stop = int(graph.offsets[node]), int(graph.offsets[node + 1])
+    chunk = max(4 * top_k, 64)
+    found = []
+    while start < stop and len(found) < top_k:
+        end = min(start + chunk, stop)
+        cols = np.asarray(graph.neighbors[start:end])
+        hits = np.flatnonzero(allowed[cols])[:top_k - len(found)]
+        found.extend(zip(cols[hits].tolist(), np.asarray(graph.scores[start:end])[hits].tolist()))
+        start = end
+        chunk *= 2
+    return found
+
+
+def file_signature(path: str) -> Tuple[int, int]:
+    """(mtime_ns, size) of a file, to notice when it is rewritten (a store's header is written last)"""
+    if os.path.isdir(path):
+        path = os.path.join(path, 'meta.json')
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results with an optional TTL
+    
+    Counts hits, misses, evictions (capacity), expirations (TTL) and
+    invalidations (clear() of a non-empty cache) so the size can be tuned.
+    Thread-safe: the server answers graph-walk queries from worker threads.
+    """
+    
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def get(self, key: Tuple) -> Any:
+        """Cached value, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key: Tuple, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self.lock:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return self._stats()
+    
+    def _stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
 
 
 class BatteryCathodeRecommender:
     """Battery cathode material recommendation engine"""
     
-    def __init__(self, adjacency_list_path: str = 'adjacency_list.json'):
+    def __init__(self, adjacency_list_path: str = 'adjacency_list.json', mmap: bool = True,
+                 data_path: str = None, cache_size: int = DEFAULT_CACHE_SIZE, cache_ttl: float = None):
         """
         Initialize
         
         Args:
-            adjacency_list_path: Path to adjacency list JSON
+            adjacency_list_path: Path to adjacency list (binary CSR or JSON)
+            mmap: Memory-map CSR graphs and decode only the rows queried
+                (False parses the whole graph into dicts)
+            data_path: Material data (store or JSON) with the properties used by
+                constraints, read on the first constrained query (default: the
+                first of DEFAULT_DATA_PATHS that exists)
+            cache_size: Query results kept in the LRU cache (0 disables it)
+            cache_ttl: Seconds a cached result stays valid (None: until evicted
+                or the graph / data file changes)
         """
         self.adjacency_list_path = adjacency_list_path
+        self.mmap = mmap
+        if data_path is None:
+            data_path = next((path for path in DEFAULT_DATA_PATHS if os.path.exists(path)), DEFAULT_DATA_PATHS[-1])
+        self.data_path = data_path
         self.graph = {}
+        self.csr = None
+        self.properties = None
+        self.node_rows = None
+        self.masks = {}
+        self.names = None
+        self.cache = QueryCache(cache_size, cache_ttl)
+        self.signature = None
+        self.data_signature = None
+        # Guards reloads and the lazily built property state against concurrent queries
+        self.lock = threading.RLock()
     
     def load_graph(self) -> Dict[str, List[Dict]]:
-        """Load adjacency list"""
+        """
+        Load adjacency list (binary CSR or JSON, detected from the file)
+        
+        State is replaced only after the file parsed, so a failed reload
+        leaves the loaded graph and its signature in place.
+        """
         if not os.path.exists(self.adjacency_list_path):
             raise FileNotFoundError("Graph file not found: {}".format(self.adjacency_list_path))
         
-        with open(self.adjacency_list_path, 'r', encoding='utf-8') as f:
-            self.graph = json.load(f)
+        # Taken before parsing, so a rewrite during the load is noticed next time
+        signature = file_signature(self.adjacency_list_path)
+        if is_csr_file(self.adjacency_list_path):
+            if self.mmap:
+                graph = CSRAdjacency(open_csr(self.adjacency_list_path))
+            else:
+                graph = load_csr(self.adjacency_list_path).to_adjacency()
+        else:
+            with open(self.adjacency_list_path, 'r', encoding='utf-8') as f:
+                graph = json.load(f)
         
+        self.graph = graph
+        self.signature = signature
+        self.csr = None
+        self.node_rows = None
+        self.masks = {}
+        self.names = None
+        self.cache.clear()
         print("[OK] Graph loaded: {} nodes".format(len(self.graph)))
         return self.graph
     
@@ -43,58 +306,358 @@ class BatteryCathodeRecommender:
         """Return all available materials"""
         return sorted(self.graph.keys())
     
-    def recommend(self, target_formula: str, top_k: int = 5) -> List[Tuple[str, float]]:
+    def name_index(self) -> NameIndex:
+        """Prefix / fuzzy name index, built on first use (the server builds it at startup)"""
+        if self.names is None:
+            self.names = NameIndex(self.graph.keys())
+        return self.names
+    
+    def autocomplete(self, prefix: str, limit: int = 10) -> List[str]:
+        """Materials whose name starts with prefix (case-insensitive)"""
+        return self.name_index().prefix(prefix, limit)
+    
+    def suggest(self, name: str, limit: int = 5) -> List[str]:
+        """Materials a mistyped or partial name probably meant"""
+        return self.name_index().suggest(name, limit)
+    
+    def not_found(self, name: str) -> ValueError:
+        """ValueError for an unknown material, with "did you mean" suggestions"""
+        message = "Material '{}' not found".format(name)
+        suggestions = self.suggest(name)
+        if suggestions:
+            message += ". Did you mean: {}?".format(', '.join(suggestions))
+        return ValueError(message)
+    
+    def neighbor_count(self, material: str) -> int:
+        """Number of stored neighbors of a material"""
+        if isinstance(self.graph, CSRAdjacency):
+            return self.graph.degree(material)
+        return len(self.graph[material])
+    
+    def csr_graph(self) -> CSRGraph:
+        """Index-based (CSR) view of the graph for the graph-walk strategies"""
+        if isinstance(self.graph, CSRAdjacency):
+            return self.graph.graph
+        if self.csr is None:
+            self.csr = CSRGraph.from_adjacency(self.graph)
+        return self.csr
+    
+    def load_properties(self) -> MaterialProperties:
+        """Property columns and indexes, loaded on first use"""
+        if self.properties is None:
+            if not os.path.exists(self.data_path):
+                raise ValueError("Material data not found: {} (needed for constraints)".format(self.data_path))
+            self.data_signature = file_signature(self.data_path)
+            self.properties = MaterialProperties.load(self.data_path)
+        return self.properties
+    
+    def check_files(self):
+        """Reload a graph and drop properties whose file changed since loading; either clears the cache"""
+        with self.lock:
+            self._check_files()
+    
+    def _check_files(self):
+        try:
+            graph_changed = self.signature is not None and file_signature(self.adjacency_list_path) != self.signature
+            data_changed = self.data_signature is not None and file_signature(self.data_path) != self.data_signature
+        except OSError:
+            # Being replaced; keep answering from what is loaded
+            return
+        if graph_changed:
+            # Not on stdout, which may be carrying batch results
+            with contextlib.redirect_stdout(sys.stderr):
+                try:
+                    self.load_graph()
+                except (OSError, ValueError, KeyError, struct.error) as e:
+                    # Caught mid-rewrite; keep answering from the loaded graph and retry on the next query
+                    print("[WARN] Graph reload failed, keeping the loaded graph: {}".format(e))
+        if data_changed:
+            self.properties = None
+            self.data_signature = None
+            self.node_rows = None
+            self.masks = {}
+            self.cache.clear()
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Query cache counters (hits, misses, evictions, ...)"""
+        return self.cache.stats()
+    
+    @staticmethod
+    def constraint_key(where) -> Tuple:
+        """Canonical (hashable, order-independent) form of constraints"""
+        if not where:
+            return ()
+        constraints = parse_constraints(where) if isinstance(where, str) else map(tuple, where)
+        return tuple(sorted(constraints))
+    
+    def allowed_nodes(self, where) -> np.ndarray:
+        """
+        Boolean mask over graph nodes satisfying the constraints
+        
+        Args:
+            where: "density < 4 and band_gap > 2", or parsed constraints
+                (see property_index.parse_constraints); materials without
+                property data never match
+        """
+        constraints = parse_constraints(where) if isinstance(where, str) else tuple(map(tuple, where))
+        with self.lock:
+            if constraints not in self.masks:
+                properties = self.load_properties()
+                graph = self.csr_graph()
+                if self.node_rows is None:
+                    self.node_rows = np.fromiter((properties.row.get(name, -1) for name in graph.names),
+                                                 dtype=np.int64, count=len(graph))
+                # Extra False slot for row -1 (no property data)
+                matching = np.append(properties.matching(constraints), False)
+                if len(self.masks) >= MASK_CACHE_SIZE:
+                    self.masks.pop(next(iter(self.masks)))
+                self.masks[constraints] = matching[self.node_rows]
+            return self.masks[constraints]
+    
+    def recommend(self, target_formula: str, top_k: int = 5, strategy: str = 'direct',
+                  max_hops: int = DEFAULT_MAX_HOPS, time_budget_ms: float = DEFAULT_TIME_BUDGET_MS,
+                  where=None) -> List[Tuple[str, float]]:
         """
         Recommend substitute materials
         
         Args:
             target_formula: Target material name
             top_k: Top N recommendations
+            strategy: 'direct' (stored neighbors), 'bfs' (best path similarity
+                product within max_hops) or 'ppr' (personalized PageRank,
+                scores scaled so the top result is 1.0)
+            max_hops: Path length limit for 'bfs'
+            time_budget_ms: Time limit for 'bfs' / 'ppr'; the best results found
+                so far are returned when it runs out
+            where: Property constraints, e.g. "density < 4 and band_gap > 2";
+                scanning goes on past top_k until top_k materials pass
         
         Returns:
             [(material, similarity), ...] sorted by similarity descending
         """
+        self.check_files()
+        key = ('recommend', target_formula, top_k, strategy,
+               max_hops if strategy == 'bfs' else None,
+               time_budget_ms if strategy != 'direct' else None,
+               self.constraint_key(where))
+        recommendations = self.cache.get(key)
+        if recommendations is None:
+            recommendations = self._recommend(target_formula, top_k, strategy, max_hops, time_budget_ms, where)
+            self.cache.put(key, recommendations)
+        return list(recommendations)
+    
+    def _recommend(self, target_formula: str, top_k: int, strategy: str, max_hops: int,
+                   time_budget_ms: float, where) -> List[Tuple[str, float]]:
+        """recommend() without the cache"""
         if target_formula not in self.graph:
-            raise ValueError("Material '{}' not found".format(target_formula))
+            raise self.not_found(target_formula)
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy '{}'".format(strategy))
         
-        neighbors = self.graph[target_formula]
+        allowed = self.allowed_nodes(where) if where else None
+        if strategy != 'direct':
+            return self._walk(target_formula, top_k, strategy, max_hops, time_budget_ms, allowed)
+        
+        if allowed is not None:
+            graph = self.csr_graph()
+            return [(graph.names[node], round(sim, 4))
+                    for node, sim in filtered_neighbors(graph, graph.find(target_formula), top_k, allowed)]
         
         # Already sorted by similarity
+        if isinstance(self.graph, CSRAdjacency):
+            neighbors = self.graph.neighbors(target_formula, limit=top_k)
+        else:
+            neighbors = self.graph[target_formula][:top_k]
+        
         recommendations = [
             (neighbor['neighbor'], neighbor['similarity'])
-            for neighbor in neighbors[:top_k]
+            for neighbor in neighbors
         ]
         
         return recommendations
     
+    def recommend_group(self, targets: Iterable[Tuple[str, float]], top_k: int = 5,
+                        where=None) -> List[Tuple[str, float]]:
+        """
+        Recommend substitutes for a group of targets
+        
+        A candidate scores the weighted mean of its similarity to each target
+        (0 where it is not a stored neighbor). The targets' CSR rows are summed
+        as sparse vectors, so the work grows with their degrees rather than
+        the graph size. The targets themselves are left out.
+        
+        Args:
+            targets: [(material, weight), ...]; repeated materials add up
+            top_k: Top N recommendations
+            where: Property constraints, as in recommend()
+        
+        Returns:
+            [(material, score), ...] sorted by score descending
+        """
+        self.check_files()
+        targets = [(target, float(weight)) for target, weight in targets]
+        key = ('group', tuple(targets), top_k, self.constraint_key(where))
+        recommendations = self.cache.get(key)
+        if recommendations is None:
+            recommendations = self._recommend_group(targets, top_k, where)
+            self.cache.put(key, recommendations)
+        return list(recommendations)
+    
+    def _recommend_group(self, targets: List[Tuple[str, float]], top_k: int, where) -> List[Tuple[str, float]]:
+        """recommend_group() without the cache"""
+        graph = self.csr_graph()
+        weights = {}
+        for target, weight in targets:
+            if target not in self.graph:
+                raise self.not_found(target)
+            if weight < 0:
+                raise ValueError("Weight of '{}' must not be negative".format(target))
+            node = graph.find(target)
+            weights[node] = weights.get(node, 0.0) + float(weight)
+        
+        total = sum(weights.values())
+        if total <= 0:
+            raise ValueError("Target weights must add up to a positive value")
+        
+        rows = [(graph.edges(node), weight / total) for node, weight in weights.items()]
+        cols = np.concatenate([cols for (cols, _), _ in rows])
+        contributions = np.concatenate([sims.astype(np.float64) * weight for (_, sims), weight in rows])
+        
+        # Sum contributions per candidate over the union of the rows only
+        nodes, inverse = np.unique(cols, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions, minlength=len(nodes))
+        keep = ~np.isin(nodes, list(weights))
+        if where:
+            keep &= self.allowed_nodes(where)[nodes]
+        
+        ranked = heapq.nsmallest(top_k, zip(scores[keep].tolist(), nodes[keep].tolist()),
+                                 key=lambda item: (-item[0], item[1]))
+        return [(graph.names[node], round(score, 4)) for score, node in ranked]
+    
+    def _walk(self, target_formula: str, top_k: int, strategy: str, max_hops: int,
+              time_budget_ms: float, allowed: np.ndarray = None) -> List[Tuple[str, float]]:
+        """Graph-walk recommendations over the CSR view"""
+        graph = self.csr_graph()
+        source = graph.find(target_formula)
+        deadline = time.perf_counter() + time_budget_ms / 1000.0 if time_budget_ms else None
+        
+        if strategy == 'bfs':
+            scores = multi_hop_scores(graph, source, top_k, max_hops, deadline=deadline, allowed=allowed)
+        else:
+            scores = personalized_pagerank(graph, source, deadline=deadline)
+        scores.pop(source, None)
+        if allowed is not None:
+            scores = {node: score for node, score in scores.items() if allowed[node]}
+        
+        ranked = heapq.nsmallest(top_k, scores.items(), key=lambda item: (-item[1], item[0]))
+        scale = 1.0
+        if strategy == 'ppr' and ranked:
+            scale = 1.0 / ranked[0][1]
+        return [(graph.names[node], round(score * scale, 4)) for node, score in ranked]
+    
+    def recommend_batch(self, lines: Iterable[str], top_k: int = 5, **options) -> Iterator[Dict[str, Any]]:
+        """
+        Recommend for a stream of targets, one result record per target
+        
+        Args:
+            lines: "formula" or "formula k" (whitespace or comma separated);
+                blank lines and lines starting with # are skipped
+            top_k: k for lines that do not give one
+            options: passed on to recommend() (strategy, ...)
+        
+        Yields:
+            {'target', 'top_k', 'recommendations'} or {'target', 'top_k', 'error'}
+        """
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            
+            parts = line.replace(',', ' ').split()
+            target = parts[0]
+            record = {'target': target, 'top_k': top_k}
+            try:
+                if len(parts) > 1:
+                    record['top_k'] = int(parts[1])
+                record['recommendations'] = self.recommend(target, record['top_k'], **options)
+            except ValueError as e:
+                record['error'] = str(e)
+            yield record
+    
+    def write_batch(self, lines: Iterable[str], output: TextIO, top_k: int = 5, fmt: str = 'jsonl',
+                    **options) -> Tuple[int, int]:
+        """
+        Stream recommend_batch() results to output as JSON Lines or CSV
+        
+        Returns:
+            (targets processed, targets with errors)
+        """
+        writer = None
+        if fmt == 'csv':
+            writer = csv.writer(output)
+            writer.writerow(['target', 'rank', 'material', 'similarity', 'error'])
+        
+        count = errors = 0
+        for record in self.recommend_batch(lines, top_k, **options):
+            count += 1
+            errors += 'error' in record
+            if writer is None:
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            elif 'error' in record:
+                writer.writerow([record['target'], '', '', '', record['error']])
+            else:
+                for rank, (material, similarity) in enumerate(record['recommendations'], 1):
+                    writer.writerow([record['target'], rank, material, similarity, ''])
+        output.flush()
+        return count, errors
+    
     def similarity_to_stars(self, similarity: float) -> str:
         """Convert similarity to star rating (0-5 stars)"""
         stars = int(round(similarity * 5))
         return '*' * stars
     
-    def print_recommendation(self, target: str, top_k: int = 5):
-        """Print recommendations"""
+    def print_recommendation(self, target: str, top_k: int = 5, **options):
+        """Print recommendations (options are passed on to recommend())"""
         try:
-            recommendations = self.recommend(target, top_k)
-            
-            if not recommendations:
-                print("No recommendations for '{}'".format(target))
-                return
-            
-            print("\n" + "=" * 70)
-            print("Recommendation for: {}".format(target))
-            print("=" * 70)
-            
-            for rank, (material, similarity) in enumerate(recommendations, 1):
-                stars = self.similarity_to_stars(similarity)
-                percentage = "{:.1f}%".format(similarity * 100)
-                print("{:2}. {:20} {} ({:>6})".format(rank, material, stars.ljust(5), percentage))
-            
-            print("=" * 70 + "\n")
-        
+            self.print_results(target, self.recommend(target, top_k, **options))
+        except ValueError as e:
+            print("Error: {}".format(e))
+    
+    def print_group_recommendation(self, targets: List[Tuple[str, float]], top_k: int = 5, where=None):
+        """Print recommendations for a group of targets"""
+        label = ", ".join("{} x{:g}".format(target, weight) for target, weight in targets)
+        try:
+            self.print_results(label, self.recommend_group(targets, top_k, where))
         except ValueError as e:
             print("Error: {}".format(e))
     
+    def print_cache_stats(self):
+        """Print query cache counters"""
+        stats = self.cache_stats()
+        print("\n" + "=" * 70)
+        print("Query Cache")
+        print("=" * 70)
+        for name, value in stats.items():
+            print("  {:15} {}".format(name, value))
+        print("=" * 70 + "\n")
+    
+    def print_results(self, label: str, recommendations: List[Tuple[str, float]]):
+        """Print a ranked recommendation table"""
+        if not recommendations:
+            print("No recommendations for '{}'".format(label))
+            return
+        
+        print("\n" + "=" * 70)
+        print("Recommendation for: {}".format(label))
+        print("=" * 70)
+        
+        for rank, (material, similarity) in enumerate(recommendations, 1):
+            stars = self.similarity_to_stars(similarity)
+            percentage = "{:.1f}%".format(similarity * 100)
+            print("{:2}. {:20} {} ({:>6})".format(rank, material, stars.ljust(5), percentage))
+        
+        print("=" * 70 + "\n")
+    
     from typing import Optional
 
     def print_available_materials(self, limit: Optional[int] = None):
@@ -106,8 +669,7 @@ class BatteryCathodeRecommender:
         print("=" * 70)
         
         for i, material in enumerate(materials[:limit] if limit else materials, 1):
-            neighbor_count = len(self.graph[material])
-            print("{:3}. {:25} ({:2} similar)".format(i, material, neighbor_count))
+            print("{:3}. {:25} ({:2} similar)".format(i, material, self.neighbor_count(material)))
         
         if limit and len(materials) > limit:
             print("... and {} more".format(len(materials) - limit))
@@ -123,11 +685,12 @@ class BatteryCathodeRecommender:
         print("  1. Get recommendations (enter material name)")
         print("  2. List all materials")
         print("  3. Exit")
+        print("  4. Cache statistics")
         print("=" * 70 + "\n")
         
         while True:
             try:
-                choice = input("Select (1-3): ").strip()
+                choice = input("Select (1-4): ").strip()
                 
                 if choice == '1':
                     target = input("Material name (e.g., LiCoO2): ").strip()
@@ -156,8 +719,11 @@ class BatteryCathodeRecommender:
                     print("Exiting...")
                     break
                 
+                elif choice == '4':
+                    self.print_cache_stats()
+                
                 else:
-                    print("Select 1-3")
+                    print("Select 1-4")
             
             except KeyboardInterrupt:
                 print("\nInterrupted")
@@ -166,6 +732,195 @@ class BatteryCathodeRecommender:
                 print("Error: {}".format(e))
 
 
+# recommend() keyword options accepted from the CLI and the server protocol
+QUERY_OPTIONS = ['strategy', 'max_hops', 'time_budget_ms', 'where']
+
+
+class RecommendationServer:
+    """
+    Long-running query server around one warm recommender
+
+    Line protocol over TCP or a Unix socket, one JSON object per line:
+      {"op": "recommend", "target": "LiCoO2", "top_k": 5, ["strategy": "bfs", ...]}
+          -> {"ok": true, "recommendations": [["LiNiO2", 0.8659], ...]}
+      {"op": "recommend_group", "targets": [["LiCoO2", 2], ["LiNiO2", 1]], "top_k": 5}
+          -> {"ok": true, "recommendations": [["LiMnO2", 0.8512], ...]}
+      {"op": "autocomplete", "prefix": "LiNi0.5", "limit": 10}
+          -> {"ok": true, "matches": ["LiNi0.5Co0.2Mn0.3O2", ...]}
+      {"op": "stats"}
+          -> {"ok": true, "cache": {"hits": 120, "misses": 14, ...}}
+      {"op": "materials"}
+          -> {"ok": true, "materials": [["Li(NiMnCo)O2", 15], ...]}
+    Failures answer {"ok": false, "error": "..."} and keep the connection open.
+    
+    Graph-walk queries (strategy bfs / ppr) can take their whole time budget,
+    so they run in the event loop's thread pool; everything else is answered
+    on the loop. Requests of one connection are still answered in order.
+    """
+    
+    def __init__(self, recommender: BatteryCathodeRecommender):
+        self.recommender = recommender
+        self.ops = {
+            'recommend': self._recommend,
+            'recommend_group': self._recommend_group,
+            'materials': self._materials,
+            'stats': self._stats,
+            'autocomplete': self._autocomplete,
+        }
+        self.requests = 0
+    
+    def _recommend(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        options = {key: request[key] for key in QUERY_OPTIONS if key in request}
+        recommendations = self.recommender.recommend(request['target'], int(request.get('top_k', 5)), **options)
+        return {'recommendations': recommendations}
+    
+    def _recommend_group(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        targets = [(target, float(weight)) for target, weight in request['targets']]
+        recommendations = self.recommender.recommend_group(targets, int(request.get('top_k', 5)), request.get('where'))
+        return {'recommendations': recommendations}
+    
+    def _materials(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        materials = self.recommender.get_available_materials()
+        return {'materials': [(material, self.recommender.neighbor_count(material)) for material in materials]}
+    
+    def _autocomplete(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return {'matches': self.recommender.autocomplete(request['prefix'], int(request.get('limit', 10)))}
+    
+    def _stats(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return {'cache': self.recommender.cache_stats()}
+    
+    @staticmethod
+    def runs_long(request: Any) -> bool:
+        """True for requests answered off the event loop"""
+        return (isinstance(request, dict) and request.get('op') == 'recommend'
+                and request.get('strategy', 'direct') != 'direct')
+    
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Answer one decoded request"""
+        op = self.ops.get(request.get('op'))
+        if op is None:
+            return {'ok': False, 'error': "Unknown op: {}".format(request.get('op'))}
+        try:
+            response = op(request)
+        except (KeyError, TypeError, ValueError) as e:
+            return {'ok': False, 'error': str(e)}
+        response['ok'] = True
+        return response
+    
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.requests += 1
+                try:
+                    request = json.loads(line)
+                    if self.runs_long(request):
+                        response = await loop.run_in_executor(None, self.handle, request)
+                    else:
+                        response = self.handle(request)
+                except (json.JSONDecodeError, AttributeError):
+                    response = {'ok': False, 'error': 'Invalid request'}
+                writer.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: str = None):
+        """Accept clients until cancelled"""
+        if socket_path:
+            server = await asyncio.start_unix_server(self._serve_client, path=socket_path)
+            print("[OK] Serving on {}".format(socket_path))
+        else:
+            server = await asyncio.start_server(self._serve_client, host, port)
+            print("[OK] Serving on {}:{}".format(host, port))
+        async with server:
+            await server.serve_forever()
+    
+    def run(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: str = None):
+        """Blocking serve() until Ctrl+C"""
+        self.recommender.name_index()
+        try:
+            asyncio.run(self.serve(host, port, socket_path))
+        except KeyboardInterrupt:
+            print("\nServer stopped")
+        finally:
+            if socket_path and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+class RemoteRecommender(BatteryCathodeRecommender):
+    """Recommender that forwards every query to a running RecommendationServer"""
+    
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: str = None):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.connection = None
+        self.stream = None
+        self.neighbor_counts = None
+    
+    def load_graph(self):
+        """Connect to the server"""
+        if self.socket_path:
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.connection.connect(self.socket_path)
+        else:
+            self.connection = socket.create_connection((self.host, self.port))
+        self.stream = self.connection.makefile('rwb')
+    
+    def request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Send one request and wait for its response"""
+        self.stream.write((json.dumps(payload, ensure_ascii=False) + '\n').encode('utf-8'))
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        response = json.loads(line)
+        if not response.pop('ok', False):
+            raise ValueError(response.get('error', 'Request failed'))
+        return response
+    
+    def recommend(self, target_formula: str, top_k: int = 5, **options) -> List[Tuple[str, float]]:
+        response = self.request(dict(options, op='recommend', target=target_formula, top_k=top_k))
+        return [tuple(item) for item in response['recommendations']]
+    
+    def recommend_group(self, targets: Iterable[Tuple[str, float]], top_k: int = 5,
+                        where=None) -> List[Tuple[str, float]]:
+        payload = {'op': 'recommend_group', 'targets': list(targets), 'top_k': top_k}
+        if where:
+            payload['where'] = where
+        response = self.request(payload)
+        return [tuple(item) for item in response['recommendations']]
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.request({'op': 'stats'})['cache']
+    
+    def autocomplete(self, prefix: str, limit: int = 10) -> List[str]:
+        return self.request({'op': 'autocomplete', 'prefix': prefix, 'limit': limit})['matches']
+    
+    def get_available_materials(self) -> List[str]:
+        response = self.request({'op': 'materials'})
+        self.neighbor_counts = dict(response['materials'])
+        return [material for material, _ in response['materials']]
+    
+    def neighbor_count(self, material: str) -> int:
+        if self.neighbor_counts is None:
+            self.get_available_materials()
+        return self.neighbor_counts[material]
+    
+    def close(self):
+        if self.connection is not None:
+            self.stream.close()
+            self.connection.close()
+            self.connection = None
+
+
 def main():
     """Main execution"""
     parser = argparse.ArgumentParser(
@@ -177,7 +932,13 @@ Examples:
   python 3_recommend.py LiCoO2 -k 10        # Top 10
   python 3_recommend.py --list              # List materials
   python 3_recommend.py --interactive       # Interactive mode
-  python 3_recommend.py --graph custom.json # Custom graph
+  python 3_recommend.py --targets LiCoO2:2 LiNiO2   # Similar to a weighted group
+  python 3_recommend.py LiCoO2 --where "density < 4 and band_gap > 2"
+  python 3_recommend.py --complete LiNi0.5     # Names starting with a prefix
+  python 3_recommend.py --graph custom.csr  # Custom graph (CSR or JSON)
+  python 3_recommend.py --serve --port 8765 # Serve queries (warm graph)
+  python 3_recommend.py --connect LiCoO2    # Query the running server
+  python 3_recommend.py --batch targets.txt --batch-format csv > out.csv
         """
     )
     
@@ -185,10 +946,73 @@ Examples:
     parser.add_argument('-k', '--top', type=int, default=5, dest='top_k', help='Number of recommendations (default: 5)')
     parser.add_argument('--list', action='store_true', help='List all materials')
     parser.add_argument('--interactive', action='store_true', help='Interactive mode')
-    parser.add_argument('--graph', default='adjacency_list.json', help='Adjacency list file path')
+    parser.add_argument('--no-mmap', action='store_true', help='Parse the whole CSR graph up front instead of memory-mapping it')
+    parser.add_argument('--graph', help='Graph file path, CSR or JSON (default: the newer of adjacency_graph.csr and adjacency_list.json)')
+    
+    parser.add_argument('--targets', nargs='+', type=weighted_target, metavar='NAME[:WEIGHT]',
+                        help='Recommend for a group of materials (weight default: 1)')
+    parser.add_argument('--where', metavar='CONSTRAINTS',
+                        help='Property filter, e.g. "density < 4 and band_gap > 2 and has Ni and no Co" '
+                             '(ops: < <= > >= =, has/no ELEMENT)')
+    parser.add_argument('--data', help='Material data with the properties for --where, store directory or JSON '
+                                       '(default: battery_cathodes.store, then battery_cathodes.json)')
+    parser.add_argument('--strategy', choices=STRATEGIES, default='direct',
+                        help='direct neighbors, multi-hop bfs, or personalized PageRank (default: direct)')
+    parser.add_argument('--hops', type=int, default=DEFAULT_MAX_HOPS, dest='max_hops', help='Max path length for bfs (default: 2)')
+    parser.add_argument('--time-budget-ms', type=float, default=DEFAULT_TIME_BUDGET_MS,
+                        help='Time limit per bfs/ppr query in ms (default: 200)')
+    parser.add_argument('--complete', metavar='PREFIX', help='List (up to -k) materials whose name starts with PREFIX')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help='Query results kept in the LRU cache, 0 = off (default: 1024)')
+    parser.add_argument('--cache-ttl', type=float, metavar='SECONDS', help='Expire cached results after SECONDS')
+    parser.add_argument('--cache-stats', action='store_true', help='Print query cache counters (of the server with --connect)')
+    parser.add_argument('--batch', metavar='PATH', help='Recommend for every target in PATH ("-" = stdin), one "formula [k]" per line')
+    parser.add_argument('--batch-output', metavar='PATH', help='Batch result file (default: stdout)')
+    parser.add_argument('--batch-format', choices=['jsonl', 'csv'], default='jsonl', help='Batch result format (default: jsonl)')
+    parser.add_argument('--serve', action='store_true', help='Run a query server that keeps the graph loaded')
+    parser.add_argument('--connect', action='store_true', help='Send the query to a running server instead of loading the graph')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='Server host (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Server port (default: 8765)')
+    parser.add_argument('--socket', help='Unix socket path to serve on / connect to instead of TCP')
+    parser.add_argument('--metrics', metavar='PATH', help='Write per-stage time/memory/throughput metrics as JSON')
+    parser.add_argument('--trace-malloc', action='store_true', help='Also record peak allocations with tracemalloc (slower)')
+    parser.add_argument('--profile', action='store_true', help='Profile the queries (or the server with --serve) with cProfile')
     
     args = parser.parse_args()
     
+    # Queries are the hot stage (a served recommender answers them in serve)
+    metrics = Instrumentation('3_recommend', trace_malloc=args.trace_malloc,
+                              profile=('serve' if args.serve else 'query') if args.profile else None)
+    try:
+        execute(args, parser, metrics)
+    finally:
+        if args.metrics:
+            metrics.write(args.metrics)
+            print("[OK] Metrics saved: {}".format(args.metrics), file=sys.stderr)
+
+
+def execute(args: argparse.Namespace, parser: argparse.ArgumentParser, metrics: Instrumentation):
+    """Run the command of main() under metrics"""
+    # Keep stdout clean for batch results
+    log = contextlib.redirect_stdout(sys.stderr) if args.batch and not args.batch_output else contextlib.nullcontext()
+    
+    if args.connect:
+        recommender = RemoteRecommender(args.host, args.port, args.socket)
+        try:
+            with log, metrics.stage('connect'):
+                recommender.load_graph()
+        except OSError as e:
+            print("Cannot connect to server: {}".format(e))
+            sys.exit(1)
+        run_command(recommender, args, parser, metrics)
+        recommender.close()
+        return
+    
+    if args.graph is None:
+        # Both exist after switching --format; the older one is stale
+        existing = [path for path in DEFAULT_GRAPH_PATHS if os.path.exists(path)]
+        args.graph = max(existing, key=os.path.getmtime) if existing else DEFAULT_GRAPH_PATHS[0]
+    
     # Check graph file
     if not os.path.exists(args.graph):
         print("Graph file not found: {}".format(args.graph))
@@ -196,19 +1020,87 @@ Examples:
         sys.exit(1)
     
     # Initialize recommender
-    recommender = BatteryCathodeRecommender(args.graph)
-    recommender.load_graph()
+    recommender = BatteryCathodeRecommender(args.graph, mmap=not args.no_mmap, data_path=args.data,
+                                            cache_size=args.cache_size, cache_ttl=args.cache_ttl)
+    with log, metrics.stage('graph_load') as record:
+        record['rows'] = len(recommender.load_graph())
     
-    # Execute command
-    if args.interactive:
+    if args.serve:
+        server = RecommendationServer(recommender)
+        with metrics.stage('serve') as record:
+            server.run(args.host, args.port, args.socket)
+            record['queries'] = server.requests
+        return
+    
+    run_command(recommender, args, parser, metrics)
+
+
+def run_command(recommender: BatteryCathodeRecommender, args: argparse.Namespace, parser: argparse.ArgumentParser,
+                metrics: Instrumentation):
+    """Execute the CLI command against a local or remote recommender"""
+    options = query_options(args)
+    if args.batch:
+        with metrics.stage('query') as record:
+            record['queries'] = run_batch(recommender, args, options)
+    elif args.interactive:
         recommender.interactive_mode()
     elif args.list:
         recommender.print_available_materials()
+    elif args.cache_stats:
+        recommender.print_cache_stats()
+    elif args.complete is not None:
+        with metrics.stage('query', queries=1):
+            names = recommender.autocomplete(args.complete, limit=args.top_k)
+        for name in names:
+            print(name)
+    elif args.targets:
+        with metrics.stage('query', queries=1):
+            recommender.print_group_recommendation(args.targets, top_k=args.top_k, where=args.where)
     elif args.target:
-        recommender.print_recommendation(args.target, top_k=args.top_k)
+        with metrics.stage('query', queries=1):
+            recommender.print_recommendation(args.target, top_k=args.top_k, **options)
     else:
         parser.print_help()
 
 
+def weighted_target(value: str) -> Tuple[str, float]:
+    """Parse "NAME" or "NAME:WEIGHT" (formulas may contain ':')"""
+    name, _, weight = value.rpartition(':')
+    if name:
+        try:
+            return name, float(weight)
+        except ValueError:
+            pass
+    return value, 1.0
+
+
+def query_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """recommend() options given on the command line (defaults left out)"""
+    options = {}
+    if args.strategy != 'direct':
+        options = {'strategy': args.strategy, 'max_hops': args.max_hops, 'time_budget_ms': args.time_budget_ms}
+    if args.where:
+        options['where'] = args.where
+    return options
+
+
+def run_batch(recommender: BatteryCathodeRecommender, args: argparse.Namespace, options: Dict[str, Any]) -> int:
+    """--batch: stream targets from a file or stdin to JSON Lines / CSV; returns the target count"""
+    source = sys.stdin if args.batch == '-' else open(args.batch, 'r', encoding='utf-8')
+    output = open(args.batch_output, 'w', encoding='utf-8', newline='') if args.batch_output else sys.stdout
+    try:
+        count, errors = recommender.write_batch(source, output, args.top_k, args.batch_format, **options)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    print("[OK] Batch done: {} targets, {} errors".format(count, errors), file=sys.stderr)
+    stats = recommender.cache_stats()
+    print("[OK] Cache: {} hits, {} misses, {} evictions".format(stats['hits'], stats['misses'], stats['evictions']),
+          file=sys.stderr)
+    return count
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,99 @@
+"""
+ANN (IVF) vs exact kNN graph benchmark
+
+Reports build time and recall@k of the IVF candidate search against the
+exact kNN graph of 2_processing.py, for several n_probe settings.
+
+Usage:
+  python benchmark_ann.py                          # battery_cathodes.json
+  python benchmark_ann.py --random 20000 -k 10     # Random materials
+  python benchmark_ann.py --probe 1 2 4 8 16
+"""
+
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+
+
+def load_processing():
+    """Import 2_processing.py (not importable by name)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '2_processing.py')
+    spec = importlib.util.spec_from_file_location('processing', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_feature_matrix(n, seed=0):
+    """Feature matrix in IMPORTANT_FEATURES order with the test-data ranges"""
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.uniform(2.5, 5.5, n),     # density
+        rng.uniform(0.2, 4.5, n),     # band_gap
+        rng.uniform(-4.0, 0.5, n),    # formation_energy_per_atom
+        rng.uniform(50.0, 200.0, n),  # volume
+    ])
+
+
+def neighbor_sets(adjacency):
+    return {node: {neighbor['neighbor'] for neighbor in neighbors} for node, neighbors in adjacency.items()}
+
+
+def recall_at_k(approx, exact, k):
+    """Mean fraction of each node's exact k neighbors found by the approximate graph"""
+    hits = 0
+    total = 0
+    for node, exact_neighbors in exact.items():
+        hits += len(exact_neighbors & approx.get(node, set()))
+        total += min(k, len(exact_neighbors))
+    return hits / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ANN (IVF) vs exact kNN graph benchmark')
+    parser.add_argument('--input', default='battery_cathodes.json', help='Material data file')
+    parser.add_argument('--random', type=int, metavar='N', help='Use N random materials instead of --input')
+    parser.add_argument('-k', type=int, default=10, help='Neighbors per material (default: 10)')
+    parser.add_argument('--lists', type=int, help='IVF cells (default: sqrt(n))')
+    parser.add_argument('--probe', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='n_probe values to try')
+    parser.add_argument('--block-size', type=int, default=1024, help='Tile size (default: 1024)')
+    args = parser.parse_args()
+
+    processing = load_processing()
+
+    if args.random:
+        feature_matrix = random_feature_matrix(args.random)
+        idx_to_material = {i: 'Material_{}'.format(i) for i in range(args.random)}
+    else:
+        materials = processing.load_materials(args.input)
+        feature_matrix, _, idx_to_material = processing.extract_features(materials)
+    features = processing.prepare_features(feature_matrix)
+    n = len(feature_matrix)
+
+    print("=" * 70)
+    print("ANN Benchmark: n={}, k={}".format(n, args.k))
+    print("=" * 70)
+
+    start = time.perf_counter()
+    exact = processing.build_knn_adjacency(features, idx_to_material, args.k, args.block_size)
+    exact_time = time.perf_counter() - start
+    exact = neighbor_sets(exact)
+    print("{:>8} {:>10} {:>10} {:>10}".format('n_probe', 'time (s)', 'speedup', 'recall@k'))
+    print("{:>8} {:>10.3f} {:>10} {:>10}".format('exact', exact_time, '1.00x', '1.0000'))
+
+    for n_probe in args.probe:
+        index = processing.IVFIndex(n_lists=args.lists, n_probe=n_probe)
+        start = time.perf_counter()
+        approx = processing.build_ann_knn_adjacency(features, idx_to_material, args.k, args.block_size, index)
+        ann_time = time.perf_counter() - start
+        recall = recall_at_k(neighbor_sets(approx), exact, args.k)
+        print("{:>8} {:>10.3f} {:>9.2f}x {:>10.4f}".format(n_probe, ann_time, exact_time / ann_time, recall))
+
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
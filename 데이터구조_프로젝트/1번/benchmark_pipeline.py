@@ -0,0 +1,225 @@
+"""
+Stage-by-stage pipeline benchmark on synthetic catalogues
+
+For each catalogue size, generates a seeded synthetic catalogue
+(synthetic.py) and measures every pipeline stage:
+  generate     synthetic columns
+  store_write  material store serialization (material_store.save_columns)
+  load         opening the store (2_processing.load_materials)
+  normalize    feature extraction + min-max normalization (builder.fit)
+  build        similarity graph build (kNN; IVF above --exact-limit)
+  graph_save   CSR serialization
+  graph_load   3_recommend graph load
+  recommend    recommend() over random targets, query cache disabled
+with wall time, CPU time, peak RSS, peak traced allocation (tracemalloc)
+and throughput, as recorded by instrumentation.py. Each size runs in a
+fresh process. The report is JSON; --compare prints the change against
+an earlier report (e.g. of the previous version).
+
+Usage:
+  python benchmark_pipeline.py                              # 10k and 100k
+  python benchmark_pipeline.py --sizes 10000 100000 1000000 --output v2.json
+  python benchmark_pipeline.py --compare v1.json            # Diff against an old report
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from instrumentation import Instrumentation
+from material_store import save_columns
+from synthetic import generate_columns
+
+REPORT_VERSION = 2
+DEFAULT_SIZES = [10000, 100000]
+DEFAULT_QUERIES = 1000
+# Largest catalogue given an exact kNN build; bigger ones use IVF
+EXACT_LIMIT = 20000
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_script(name, filename):
+    """Import a numbered pipeline script (not importable by name)"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_size(n, seed, knn, queries, top_k, exact_limit, trace):
+    """Benchmark every stage on a catalogue of n materials (stage output silenced)"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return _run_size(n, seed, knn, queries, top_k, exact_limit, trace)
+
+
+def _run_size(n, seed, knn, queries, top_k, exact_limit, trace):
+    processing = load_script('processing', '2_processing.py')
+    recommend = load_script('recommend', '3_recommend.py')
+    metrics = Instrumentation('benchmark', trace_malloc=trace)
+    run = {'size': n}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store_path = os.path.join(workdir, 'battery_cathodes.store')
+        graph_path = os.path.join(workdir, 'adjacency_graph.csr')
+
+        with metrics.stage('generate', rows=n):
+            numeric, strings = generate_columns(n, seed)
+        with metrics.stage('store_write', rows=n):
+            save_columns(store_path, numeric, strings)
+        del numeric, strings
+        with metrics.stage('load', rows=n):
+            materials = processing.load_materials(store_path)
+
+        builder = processing.SimilarityGraphBuilder()
+        with metrics.stage('normalize', rows=n):
+            builder.fit(materials)
+        ann = processing.IVFIndex() if knn and n > exact_limit else None
+        m = len(builder.idx_to_material)
+        with metrics.stage('build', rows=m, pairs=None if ann else m * (m - 1) // 2):
+            adjacency = builder.build(knn=knn or None, ann=ann)
+        with metrics.stage('graph_save', rows=m):
+            builder.save(graph_path)
+
+        run['materials'] = m
+        run['edges'] = sum(len(neighbors) for neighbors in adjacency.values())
+        run['graph_bytes'] = os.path.getsize(graph_path)
+        run['mode'] = 'knn={}{}'.format(knn, ' ivf' if ann else '') if knn else 'threshold={}'.format(builder.threshold)
+        names = list(builder.idx_to_material.values())
+        del builder, adjacency, materials
+
+        recommender = recommend.BatteryCathodeRecommender(graph_path, data_path=store_path, cache_size=0)
+        with metrics.stage('graph_load', rows=m):
+            recommender.load_graph()
+
+        targets = [names[i] for i in np.random.default_rng(seed).integers(0, len(names), queries)]
+        with metrics.stage('recommend', queries=queries):
+            latencies = query_latencies(recommender, targets, top_k)
+
+    run['stages'] = {record.pop('stage'): record for record in metrics.stages}
+    run['recommend_latency_ms'] = {
+        'mean': round(float(np.mean(latencies)), 4),
+        'p50': round(float(np.percentile(latencies, 50)), 4),
+        'p95': round(float(np.percentile(latencies, 95)), 4),
+        'p99': round(float(np.percentile(latencies, 99)), 4),
+        'max': round(float(np.max(latencies)), 4),
+    }
+    return run
+
+
+def query_latencies(recommender, targets, top_k):
+    """Latency of each recommend() call in ms"""
+    latencies = []
+    for target in targets:
+        start = time.perf_counter()
+        recommender.recommend(target, top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    print("{:>9} {:<12} {:>10} {:>10} {:>11} {:>11}".format('size', 'stage', 'wall (s)', 'cpu (s)', 'alloc (MB)', 'rss (MB)'))
+    for run in report['runs']:
+        for stage, entry in run['stages'].items():
+            # peak_rss_mb is None where the platform cannot measure it
+            rss = '-' if entry['peak_rss_mb'] is None else '{:.1f}'.format(entry['peak_rss_mb'])
+            print("{:>9} {:<12} {:>10.3f} {:>10.3f} {:>11} {:>11}".format(
+                run['size'], stage, entry['wall_s'], entry['cpu_s'], entry.get('peak_alloc_mb', '-'), rss))
+        latency = run['recommend_latency_ms']
+        print("{:>9} edges={} graph={} bytes, recommend p50={}ms p95={}ms p99={}ms".format(
+            run['size'], run['edges'], run['graph_bytes'], latency['p50'], latency['p95'], latency['p99']))
+
+
+def print_comparison(report, baseline):
+    """Wall time and peak allocation of each (size, stage) relative to a baseline report"""
+    previous = {(run['size'], stage): entry for run in baseline['runs'] for stage, entry in run['stages'].items()}
+    print("\nvs {} ({})".format(baseline.get('commit') or '?', baseline.get('created', '?')))
+    print("{:>9} {:<12} {:>10} {:>10} {:>9} {:>11}".format('size', 'stage', 'old (s)', 'new (s)', 'time', 'alloc'))
+    for run in report['runs']:
+        for stage, entry in run['stages'].items():
+            old = previous.get((run['size'], stage))
+            if old is None:
+                continue
+            alloc = '-'
+            if old.get('peak_alloc_mb') and entry.get('peak_alloc_mb') is not None:
+                alloc = '{:+.1f}%'.format((entry['peak_alloc_mb'] / old['peak_alloc_mb'] - 1) * 100)
+            print("{:>9} {:<12} {:>10.3f} {:>10.3f} {:>+8.1f}% {:>11}".format(
+                run['size'], stage, old['wall_s'], entry['wall_s'], (entry['wall_s'] / max(old['wall_s'], 1e-9) - 1) * 100, alloc))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stage-by-stage pipeline benchmark on synthetic catalogues')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Catalogue sizes (default: 10000 100000)')
+    parser.add_argument('--seed', type=int, default=0, help='Synthetic data and query seed (default: 0)')
+    parser.add_argument('-k', '--knn', type=int, default=10, help='Neighbors per material (default: 10, 0 = threshold graph)')
+    parser.add_argument('--exact-limit', type=int, default=EXACT_LIMIT, help='Largest size built exactly (default: 20000)')
+    parser.add_argument('--queries', type=int, default=DEFAULT_QUERIES, help='recommend() calls per size (default: 1000)')
+    parser.add_argument('--top', type=int, default=5, help='Recommendations per query (default: 5)')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='Skip allocation tracing (lower overhead, timing only)')
+    parser.add_argument('--output', default='benchmark_report.json', help='Report path (default: benchmark_report.json)')
+    parser.add_argument('--compare', metavar='REPORT', help='Earlier report to compare against')
+    args = parser.parse_args()
+
+    report = {
+        'version': REPORT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'params': {
+            'seed': args.seed,
+            'knn': args.knn,
+            'exact_limit': args.exact_limit,
+            'queries': args.queries,
+            'top_k': args.top,
+            'tracemalloc': not args.no_tracemalloc,
+        },
+        'runs': [],
+    }
+
+    for n in args.sizes:
+        print("[..] n={}".format(n), file=sys.stderr)
+        # Fresh process per size: peak RSS belongs to this size alone
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            run = pool.submit(run_size, n, args.seed, args.knn, args.queries, args.top,
+                              args.exact_limit, not args.no_tracemalloc).result()
+        report['runs'].append(run)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print("=" * 70)
+    print("Pipeline Benchmark")
+    print("=" * 70)
+    print_report(report)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(report, json.load(f))
+    print("=" * 70)
+    print("[OK] Report saved: {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Chemical formula parsing and element bitmasks
+
+Used by 1_dataload.py (Li filter, categories), material_store.py (stored
+composition) and property_index.py ("has Ni and no Co" constraints).
+
+A formula such as "Li(NiMnCo)O2" or "LiNi0.8Co0.15Al0.05O2" is parsed
+once (results are memoized, catalogues repeat formulas a lot) into element
+amounts. Each material then gets
+  - a 128-bit element mask, bit Z-1 set for every element present, kept
+    as two uint64 words so a whole catalogue is an (n, 2) array, and
+  - its element fractions, kept sparse (CSR: offsets, element indices,
+    fractions) like the graph rows.
+Element queries over the catalogue are then a few vectorized AND/compare
+operations on the mask array.
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+
+ELEMENTS = [
+    'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne', 'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar',
+    'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr',
+    'Rb', 'Sr', 'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn', 'Sb', 'Te', 'I', 'Xe',
+    'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd', 'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb', 'Lu',
+    'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn',
+    'Fr', 'Ra', 'Ac', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm', 'Md', 'No', 'Lr',
+    'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds', 'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og',
+]
+ELEMENT_INDEX = {symbol: i for i, symbol in enumerate(ELEMENTS)}
+
+# Distinct formulas remembered by the parser
+FORMULA_CACHE_SIZE = 1 << 16
+
+# Category -> (elements required, elements excluded)
+CATEGORY_RULES = {
+    'LCO': (['Co'], ['Mn']),
+    'NCM': (['Ni', 'Mn'], []),
+    'LFP': (['Fe', 'P'], []),
+}
+
+TOKEN = re.compile(r'([A-Z][a-z]?)|([(\[])|([)\]])|(\d+(?:\.\d*)?|\.\d+)')
+# Copy suffix of generated duplicates, e.g. "LiFePO4_3"
+COPY_SUFFIX = re.compile(r'_\d+$')
+WORD = (1 << 64) - 1
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def parse_formula(formula):
+    """
+    Element amounts of a formula, ((symbol, amount), ...) in atomic-number order
+
+    Handles nested parentheses/brackets, decimal amounts and a "_<n>" copy
+    suffix. Raises ValueError for anything else.
+    """
+    text = COPY_SUFFIX.sub('', formula.replace(' ', ''))
+    stack = [{}]
+    # Element or closed group waiting for a possible multiplier
+    pending = None
+    pos = 0
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError("Cannot parse formula '{}' at '{}'".format(formula, text[pos:]))
+        symbol, opening, closing, number = match.groups()
+        pos = match.end()
+
+        if number:
+            if pending is None:
+                raise ValueError("Misplaced number in formula '{}'".format(formula))
+            _merge(stack[-1], pending, float(number))
+            pending = None
+            continue
+        if pending is not None:
+            _merge(stack[-1], pending)
+            pending = None
+
+        if symbol:
+            if symbol not in ELEMENT_INDEX:
+                raise ValueError("Unknown element '{}' in formula '{}'".format(symbol, formula))
+            pending = {symbol: 1.0}
+        elif opening:
+            stack.append({})
+        else:
+            if len(stack) == 1:
+                raise ValueError("Unbalanced '{}' in formula '{}'".format(closing, formula))
+            pending = stack.pop()
+
+    if pending is not None:
+        _merge(stack[-1], pending)
+    if len(stack) != 1 or not stack[0]:
+        raise ValueError("Cannot parse formula '{}'".format(formula))
+    return tuple(sorted(stack[0].items(), key=lambda item: ELEMENT_INDEX[item[0]]))
+
+
+def _merge(counts, amounts, multiplier=1.0):
+    for element, amount in amounts.items():
+        counts[element] = counts.get(element, 0.0) + amount * multiplier
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def element_mask(formula):
+    """128-bit element mask of a formula as an int (0 if it does not parse)"""
+    try:
+        return mask_of(element for element, _ in parse_formula(formula))
+    except ValueError:
+        return 0
+
+
+def mask_of(elements):
+    """128-bit mask of element symbols"""
+    mask = 0
+    for element in elements:
+        if element not in ELEMENT_INDEX:
+            raise ValueError("Unknown element '{}'".format(element))
+        mask |= 1 << ELEMENT_INDEX[element]
+    return mask
+
+
+def mask_words(mask):
+    """int mask -> uint64[2] (low word, high word)"""
+    return np.array([mask & WORD, mask >> 64], dtype=np.uint64)
+
+
+def element_masks(formulas):
+    """(n, 2) uint64 masks of formulas; unparseable formulas get no bits"""
+    # Copies ("LiCoO2_7") share the memoized entry of their base formula
+    masks = [element_mask(COPY_SUFFIX.sub('', formula)) if formula else 0 for formula in formulas]
+    words = np.empty((len(masks), 2), dtype=np.uint64)
+    words[:, 0] = [mask & WORD for mask in masks]
+    words[:, 1] = [mask >> 64 for mask in masks]
+    return words
+
+
+def composition_table(formulas):
+    """
+    Element fractions of formulas as CSR arrays
+
+    Returns:
+        (offsets int64[n + 1], elements uint8[m], fractions float32[m]);
+        row i is elements/fractions[offsets[i]:offsets[i + 1]], empty if
+        the formula does not parse
+    """
+    rows = []
+    for formula in formulas:
+        try:
+            rows.append(parse_formula(COPY_SUFFIX.sub('', formula)) if formula else ())
+        except ValueError:
+            rows.append(())
+
+    lengths = np.array([len(row) for row in rows], dtype=np.int64)
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    elements = np.fromiter((ELEMENT_INDEX[element] for row in rows for element, _ in row),
+                           dtype=np.uint8, count=int(offsets[-1]))
+    amounts = np.fromiter((amount for row in rows for _, amount in row), dtype=np.float64, count=int(offsets[-1]))
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    totals = np.bincount(owner, weights=amounts, minlength=len(rows))
+    fractions = (amounts / totals[owner]).astype(np.float32)
+    return offsets, elements, fractions
+
+
+def select(masks, include=(), exclude=()):
+    """Boolean rows of an (n, 2) mask array containing every `include` element and no `exclude` element"""
+    required = mask_words(mask_of(include))
+    forbidden = mask_words(mask_of(exclude))
+    keep = ((masks & required) == required).all(axis=1)
+    keep &= ((masks & forbidden) == 0).all(axis=1)
+    return keep
+
+
+def categorize(masks):
+    """{category: row indices} by CATEGORY_RULES"""
+    return {name: np.flatnonzero(select(masks, include, exclude)) for name, (include, exclude) in CATEGORY_RULES.items()}
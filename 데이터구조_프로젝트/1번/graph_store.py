@@ -0,0 +1,277 @@
+"""
+Binary CSR (compressed sparse row) graph format
+
+Shared by 2_processing.py (writer) and 3_recommend.py (reader).
+
+Layout (little-endian):
+  magic       8 bytes   b'CSRGRAPH'
+  header_len  uint32
+  header      UTF-8 JSON {"version", "nodes", "edges", "score_dtype",
+                          "sections": {name: [byte offset, dtype, length]},
+                          "params": build parameters (optional, see 2_processing.py)}
+  sections    each 8-byte aligned
+    offsets       int64[n + 1]    edges of node i are offsets[i]:offsets[i + 1]
+    neighbors     int32[m]        neighbor node indices
+    scores        float32[m]      similarity (or float16)
+    name_offsets  int64[n + 1]    formula of node i is names[name_offsets[i]:name_offsets[i + 1]]
+    names         uint8[...]      UTF-8 string table
+    name_order    int32[n]        node indices sorted by formula (binary search lookup)
+
+Node order is the key order of the adjacency dict, and each node's edges
+keep the adjacency list order (similarity descending).
+
+open_csr() memory-maps the sections instead of reading them, so a lookup
+touches only the pages of one formula search and one neighbor slice, and
+processes opening the same file share the OS page cache.
+"""
+
+import json
+import os
+import struct
+from collections.abc import Mapping
+
+import numpy as np
+
+MAGIC = b'CSRGRAPH'
+VERSION = 1
+SCORE_DTYPES = ('float32', 'float16')
+ALIGN = 8
+
+
+def is_csr_file(path):
+    """True if path starts with the CSR magic"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class MappedNames:
+    """Formula table decoded one entry at a time from a (memory-mapped) UTF-8 blob"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class CSRGraph:
+    """Graph as CSR arrays plus a formula table"""
+
+    def __init__(self, names, offsets, neighbors, scores, name_order=None, params=None):
+        self.names = names
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.scores = scores
+        self.name_order = name_order
+        # Parameters the graph was built with, stored in the header
+        self.params = params
+        self._index = None
+
+    def find(self, name):
+        """Node index of a formula, or None"""
+        if self.name_order is None:
+            if self._index is None:
+                self._index = {node: i for i, node in enumerate(self.names)}
+            return self._index.get(name)
+
+        low, high = 0, len(self.name_order)
+        while low < high:
+            mid = (low + high) // 2
+            if self.names[self.name_order[mid]] < name:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(self.name_order) and self.names[self.name_order[low]] == name:
+            return int(self.name_order[low])
+        return None
+
+    def degree(self, i):
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+    @classmethod
+    def from_adjacency(cls, adjacency, score_dtype='float32', params=None):
+        """Convert {formula: [{'neighbor': ..., 'similarity': ...}, ...]}"""
+        names = list(adjacency)
+        index = {name: i for i, name in enumerate(names)}
+        num_edges = sum(len(neighbors) for neighbors in adjacency.values())
+
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(neighbors) for neighbors in adjacency.values()])
+        neighbors = np.fromiter((index[edge['neighbor']] for edges in adjacency.values() for edge in edges),
+                                dtype=np.int32, count=num_edges)
+        scores = np.fromiter((edge['similarity'] for edges in adjacency.values() for edge in edges),
+                             dtype=np.float64, count=num_edges).astype(score_dtype)
+        return cls(names, offsets, neighbors, scores, params=params)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def num_edges(self):
+        return int(self.offsets[-1])
+
+    def edges(self, i):
+        """(neighbor indices, scores) of node i"""
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.neighbors[start:stop], self.scores[start:stop]
+
+    def row(self, i, limit=None):
+        """Neighbor list of node i (scores rounded to 4 decimals as in the JSON)"""
+        cols, sims = self.edges(i)
+        if limit is not None:
+            cols, sims = cols[:limit], sims[:limit]
+        return [
+            {'neighbor': self.names[j], 'similarity': round(float(sim), 4)}
+            for j, sim in zip(cols.tolist(), sims.tolist())
+        ]
+
+    def to_adjacency(self):
+        """Back to the adjacency dict"""
+        return {name: self.row(i) for i, name in enumerate(self.names)}
+
+
+class CSRAdjacency(Mapping):
+    """
+    Read-only {formula: neighbor list} view of a CSRGraph
+
+    Rows are decoded only when accessed, so it can stand in for the
+    adjacency dict over a memory-mapped graph.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, name):
+        i = self.graph.find(name)
+        if i is None:
+            raise KeyError(name)
+        return self.graph.row(i)
+
+    def __contains__(self, name):
+        return self.graph.find(name) is not None
+
+    def __iter__(self):
+        return iter(self.graph.names)
+
+    def __len__(self):
+        return len(self.graph)
+
+    def neighbors(self, name, limit=None):
+        """First `limit` entries of a neighbor list, decoding only those"""
+        i = self.graph.find(name)
+        if i is None:
+            raise KeyError(name)
+        return self.graph.row(i, limit)
+
+    def degree(self, name):
+        i = self.graph.find(name)
+        if i is None:
+            raise KeyError(name)
+        return self.graph.degree(i)
+
+
+def save_csr(graph, path):
+    """
+    Write a CSRGraph
+
+    The file is written next to path and renamed over it, so a reader that
+    has the old file memory-mapped keeps seeing the old graph.
+    """
+    encoded = [name.encode('utf-8') for name in graph.names]
+    name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    name_offsets[1:] = np.cumsum([len(name) for name in encoded])
+
+    arrays = [
+        ('offsets', np.ascontiguousarray(graph.offsets, dtype='<i8')),
+        ('neighbors', np.ascontiguousarray(graph.neighbors, dtype='<i4')),
+        ('scores', np.ascontiguousarray(graph.scores, dtype=np.dtype(graph.scores.dtype).newbyteorder('<'))),
+        ('name_offsets', name_offsets.astype('<i8')),
+        ('names', np.frombuffer(b''.join(encoded), dtype=np.uint8)),
+        ('name_order', np.argsort(np.array(graph.names, dtype=object), kind='stable').astype('<i4')),
+    ]
+
+    # Header size depends on the offsets it contains, so lay out until stable
+    header_len = 0
+    while True:
+        position = _align(len(MAGIC) + 4 + header_len)
+        sections = {}
+        for name, array in arrays:
+            sections[name] = [position, array.dtype.str, len(array)]
+            position = _align(position + array.nbytes)
+        header = {
+            'version': VERSION,
+            'nodes': len(graph.names),
+            'edges': len(graph.neighbors),
+            'score_dtype': np.dtype(graph.scores.dtype).name,
+            'sections': sections,
+        }
+        if graph.params is not None:
+            header['params'] = graph.params
+        header = json.dumps(header).encode('utf-8')
+        if len(header) == header_len:
+            break
+        header_len = len(header)
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for name, array in arrays:
+            f.write(b'\0' * (sections[name][0] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(temporary, path)
+
+
+def read_header(f):
+    """Parse the header of an open CSR file"""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a CSR graph file")
+    (header_len,) = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    if header['version'] != VERSION:
+        raise ValueError("Unsupported CSR graph version: {}".format(header['version']))
+    return header
+
+
+def load_csr(path):
+    """Read a CSR graph file fully into memory"""
+    with open(path, 'rb') as f:
+        header = read_header(f)
+        arrays = {}
+        for name, (offset, dtype, length) in header['sections'].items():
+            f.seek(offset)
+            arrays[name] = np.fromfile(f, dtype=dtype, count=length)
+
+    names_blob = arrays['names'].tobytes()
+    name_offsets = arrays['name_offsets'].tolist()
+    names = [names_blob[name_offsets[i]:name_offsets[i + 1]].decode('utf-8') for i in range(header['nodes'])]
+    return CSRGraph(names, arrays['offsets'], arrays['neighbors'], arrays['scores'], params=header.get('params'))
+
+
+def open_csr(path):
+    """Memory-map a CSR graph file; nothing beyond the header is read up front"""
+    with open(path, 'rb') as f:
+        header = read_header(f)
+
+    arrays = {}
+    for name, (offset, dtype, length) in header['sections'].items():
+        if length == 0:
+            arrays[name] = np.zeros(0, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(length,))
+
+    names = MappedNames(arrays['names'], arrays['name_offsets'])
+    return CSRGraph(names, arrays['offsets'], arrays['neighbors'], arrays['scores'], arrays.get('name_order'),
+                    header.get('params'))
+
+
+def _align(position):
+    return (position + ALIGN - 1) // ALIGN * ALIGN
@@ -0,0 +1,133 @@
+"""
+Per-stage timing and memory metrics
+
+Used by 1_dataload.py, 2_processing.py and 3_recommend.py (--metrics,
+--profile) and benchmark_pipeline.py.
+
+Each `with metrics.stage(name, rows=...)` block records
+  wall_s, cpu_s     perf_counter / process_time spent in the block
+  peak_rss_mb       peak resident set size during the block (Linux resets
+                    the high-water mark through /proc/self/clear_refs;
+                    elsewhere it is the process peak so far, and None
+                    without the Unix-only resource module, e.g. Windows)
+  peak_alloc_mb     peak Python/NumPy allocation above what was allocated
+                    at the start, with trace_malloc only (tracemalloc
+                    slows allocation-heavy code)
+  rows_per_s, pairs_per_s, queries_per_s
+                    from the rows / pairs / queries counts given to
+                    stage() or set on the yielded record
+The stage named by `profile` also runs under cProfile; its stats are
+dumped to a .prof file (read with pstats or snakeviz) and the top
+functions printed to stderr (stdout may carry batch results).
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Count key -> throughput key
+THROUGHPUT = {'rows': 'rows_per_s', 'pairs': 'pairs_per_s', 'queries': 'queries_per_s'}
+# Functions printed from a profile
+PROFILE_LINES = 20
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1 << 20)
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class Instrumentation:
+    """Stage records of one pipeline run"""
+
+    def __init__(self, name, trace_malloc=False, profile=None, profile_path=None):
+        self.name = name
+        self.trace_malloc = trace_malloc
+        self.profile = profile
+        self.profile_path = profile_path or 'profile.{}.{}.prof'.format(name, profile)
+        self.stages = []
+        self.started = time.time()
+        if trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """Measure the block as stage `name`; yields its record for counts known only later"""
+        record = {'stage': name}
+        record.update(counts)
+        profiler = cProfile.Profile() if name == self.profile else None
+
+        _reset_peak_rss()
+        allocated = 0
+        if self.trace_malloc:
+            tracemalloc.reset_peak()
+            allocated = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            record['wall_s'] = round(wall, 6)
+            record['cpu_s'] = round(cpu, 6)
+            peak_rss = _peak_rss_mb()
+            record['peak_rss_mb'] = round(peak_rss, 3) if peak_rss is not None else None
+            if self.trace_malloc:
+                record['peak_alloc_mb'] = round((tracemalloc.get_traced_memory()[1] - allocated) / (1 << 20), 3)
+            for count, rate in THROUGHPUT.items():
+                if record.get(count) is not None:
+                    record[rate] = round(record[count] / wall, 1) if wall > 0 else None
+            self.stages.append(record)
+            if profiler is not None:
+                self._dump_profile(profiler)
+
+    def _dump_profile(self, profiler):
+        profiler.dump_stats(self.profile_path)
+        print("\n[Profile] {} -> {}".format(self.profile, self.profile_path), file=sys.stderr)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(PROFILE_LINES)
+
+    def get(self, name):
+        """Last record of a stage (None if it did not run)"""
+        return next((record for record in reversed(self.stages) if record['stage'] == name), None)
+
+    def report(self):
+        return {
+            'script': self.name,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'argv': sys.argv[1:],
+            'pid': os.getpid(),
+            'total_wall_s': round(time.time() - self.started, 6),
+            'stages': self.stages,
+        }
+
+    def write(self, path):
+        """Write the records as JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
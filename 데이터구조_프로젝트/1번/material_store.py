@@ -0,0 +1,296 @@
+"""
+Columnar binary materials store
+
+Written by 1_dataload.py, read by 2_processing.py and 3_recommend.py in
+place of battery_cathodes.json.
+
+A store is a directory of .npy arrays plus a small JSON header:
+  meta.json                 {"version", "count", "columns", "strings", "categories"}
+  <column>.npy              float64[count]  numeric property (NaN = missing)
+  <string>.npy              uint8[...]      UTF-8 string table (material_id, formula)
+  <string>.offsets.npy      int64[count + 1] entry i is blob[offsets[i]:offsets[i + 1]]
+  category.<name>.npy       int32[...]      rows of the category
+  element_mask.npy          uint64[count, 2] 128-bit element mask of each formula
+  composition.offsets.npy   int64[count + 1] element fractions of row i are
+  composition.elements.npy  uint8[...]        elements/fractions[offsets[i]:offsets[i + 1]]
+  composition.fractions.npy float32[...]      (element index = atomic number - 1)
+
+Every material is stored once; categories only list row indices (the JSON
+repeated each categorized material under "General"). open_store()
+memory-maps the arrays, so feature columns are read straight into NumPy.
+Formulas are parsed once at write time (composition.py); element queries
+run on the mask array.
+"""
+
+import json
+import os
+import shutil
+from collections.abc import Sequence
+
+import numpy as np
+
+import composition
+from graph_store import MappedNames
+
+VERSION = 2
+META_FILE = 'meta.json'
+STRING_COLUMNS = ['material_id', 'formula']
+COMPOSITION_ARRAYS = ['offsets', 'elements', 'fractions']
+# Numeric columns written first and in this order; other numeric keys follow
+NUMERIC_COLUMNS = ['density', 'band_gap', 'formation_energy_per_atom', 'volume']
+# StoreWriter stages each array as raw rows in <name>.npy.part until close()
+PART_SUFFIX = '.npy.part'
+
+
+def is_store(path):
+    """True if path is a materials store directory"""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE))
+
+
+class MaterialStore:
+    """Numeric columns, string tables and category row lists of a materials catalogue"""
+
+    def __init__(self, columns, strings, categories, element_masks=None, composition=None):
+        self.columns = columns
+        self.strings = strings
+        self.categories = categories
+        self.element_masks = element_masks
+        self.composition = composition
+
+    def __len__(self):
+        return len(self.strings['formula'])
+
+    def material(self, i):
+        """Row i as a material dict (missing values left out)"""
+        mat = {}
+        for name, table in self.strings.items():
+            value = table[i]
+            if value:
+                mat[name] = value
+        for name, values in self.columns.items():
+            value = float(values[i])
+            if not np.isnan(value):
+                mat[name] = value
+        return mat
+
+    def __getitem__(self, i):
+        return self.material(i)
+
+    def __iter__(self):
+        return (self.material(i) for i in range(len(self)))
+
+    def features(self, names):
+        """(matrix of the named columns, rows where all of them are present)"""
+        matrix = np.column_stack([np.asarray(self.columns[name], dtype=np.float64) for name in names])
+        rows = np.flatnonzero(~np.isnan(matrix).any(axis=1))
+        return matrix[rows], rows
+
+    def category(self, name):
+        """Row indices of a category"""
+        return self.categories[name]
+
+    def rows(self, rows):
+        """Lazy sequence of the material dicts of some rows"""
+        return MaterialRows(self, rows)
+
+    def select(self, include=(), exclude=()):
+        """Rows whose formula contains every `include` element and no `exclude` element"""
+        return np.flatnonzero(composition.select(self.element_masks, include, exclude))
+
+    def fractions(self, i):
+        """{element: atomic fraction} of row i"""
+        offsets, elements, fractions = self.composition
+        start, stop = offsets[i], offsets[i + 1]
+        return {composition.ELEMENTS[element]: float(fraction)
+                for element, fraction in zip(elements[start:stop].tolist(), fractions[start:stop].tolist())}
+
+
+class MaterialRows(Sequence):
+    """Material dicts of selected store rows, built only when accessed"""
+
+    def __init__(self, store, rows):
+        self.store = store
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return self.store.material(int(self.rows[i]))
+
+
+def save_store(path, materials, categories=None):
+    """
+    Write materials (dicts) as a store
+
+    Args:
+        path: store directory (created; existing arrays are replaced)
+        materials: material dicts, one row each
+        categories: {name: row indices}
+    """
+    materials = list(materials)
+    numeric = list(NUMERIC_COLUMNS)
+    for mat in materials:
+        for key, value in mat.items():
+            if key not in numeric and key not in STRING_COLUMNS and _is_number(value):
+                numeric.append(key)
+
+    columns = {name: np.array([mat[name] if _is_number(mat.get(name)) else np.nan for mat in materials], dtype=np.float64)
+               for name in numeric}
+    strings = {name: [str(mat[name]) if mat.get(name) is not None else '' for mat in materials] for name in STRING_COLUMNS}
+    save_columns(path, columns, strings, categories)
+
+
+def save_columns(path, columns, strings, categories=None):
+    """
+    Write a store from columns, without building material dicts
+
+    Args:
+        path: store directory (created; existing arrays are replaced)
+        columns: {name: float64[count]} numeric columns (NaN = missing)
+        strings: {name: [str] * count} for each of STRING_COLUMNS ('' = missing)
+        categories: {name: row indices}
+    """
+    writer = StoreWriter(path)
+    writer.append(columns, strings, categories)
+    writer.close()
+
+
+class StoreWriter:
+    """
+    Write a store a chunk of rows at a time
+
+    append() adds the chunk's rows to every array of the store (row indices
+    and offsets shifted past the rows already written), so only one chunk is
+    in memory; close() turns the staged arrays into .npy files and writes the
+    header. Every chunk must have the same numeric columns.
+    """
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(('.npy', PART_SUFFIX)) or name == META_FILE:
+                os.remove(os.path.join(path, name))
+        self.path = path
+        self.count = 0
+        self.columns = None
+        self.files = {}
+        self.layouts = {}
+        self.lengths = {}
+        # Bytes/entries written so far, added to the chunk's offsets
+        self.sizes = dict.fromkeys(STRING_COLUMNS + ['composition'], 0)
+
+        # Arrays that exist even when no row is appended
+        for name in STRING_COLUMNS:
+            self._write(name, np.zeros(0, dtype=np.uint8))
+            self._write(name + '.offsets', np.zeros(1, dtype=np.int64))
+        self._write('element_mask', np.zeros((0, 2), dtype=np.uint64))
+        self._write('composition.offsets', np.zeros(1, dtype=np.int64))
+        self._write('composition.elements', np.zeros(0, dtype=np.uint8))
+        self._write('composition.fractions', np.zeros(0, dtype=np.float32))
+
+    def append(self, columns, strings, categories=None):
+        """
+        Add rows
+
+        Args:
+            columns: {name: float64[n]} numeric columns (NaN = missing)
+            strings: {name: [str] * n} for each of STRING_COLUMNS ('' = missing)
+            categories: {name: row indices within this chunk}
+        """
+        if self.columns is None:
+            self.columns = list(columns)
+        for name in self.columns:
+            self._write(name, np.asarray(columns[name], dtype=np.float64))
+
+        for name in STRING_COLUMNS:
+            encoded = [value.encode('utf-8') for value in strings[name]]
+            ends = self.sizes[name] + np.cumsum([len(value) for value in encoded], dtype=np.int64)
+            self._write(name, np.frombuffer(b''.join(encoded), dtype=np.uint8))
+            self._write(name + '.offsets', ends)
+            if len(ends):
+                self.sizes[name] = int(ends[-1])
+
+        for name, rows in (categories or {}).items():
+            self._write('category.' + name, (self.count + np.asarray(rows, dtype=np.int64)).astype(np.int32))
+
+        formulas = strings['formula']
+        self._write('element_mask', composition.element_masks(formulas))
+        offsets, elements, fractions = composition.composition_table(formulas)
+        self._write('composition.offsets', self.sizes['composition'] + offsets[1:])
+        self._write('composition.elements', elements)
+        self._write('composition.fractions', fractions)
+        self.sizes['composition'] += int(offsets[-1])
+        self.count += len(formulas)
+
+    def close(self):
+        """Write the .npy arrays and the header"""
+        for name, f in self.files.items():
+            f.close()
+            dtype, shape = self.layouts[name]
+            part = os.path.join(self.path, name + PART_SUFFIX)
+            with open(os.path.join(self.path, name + '.npy'), 'wb') as out:
+                np.lib.format.write_array_header_1_0(out, {
+                    'descr': np.lib.format.dtype_to_descr(dtype),
+                    'fortran_order': False,
+                    'shape': (self.lengths[name],) + shape,
+                })
+                with open(part, 'rb') as src:
+                    shutil.copyfileobj(src, out, 1 << 20)
+            os.remove(part)
+
+        # Header last: a store without it is incomplete
+        meta = {
+            'version': VERSION,
+            'count': self.count,
+            'columns': self.columns or [],
+            'strings': STRING_COLUMNS,
+            'categories': [name[len('category.'):] for name in self.files if name.startswith('category.')],
+        }
+        with open(os.path.join(self.path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+    def _write(self, name, array):
+        """Append rows to an array (the first write fixes its dtype and row shape)"""
+        if name not in self.files:
+            self.files[name] = open(os.path.join(self.path, name + PART_SUFFIX), 'wb')
+            self.layouts[name] = (array.dtype, array.shape[1:])
+            self.lengths[name] = 0
+        dtype, _ = self.layouts[name]
+        np.ascontiguousarray(array, dtype=dtype).tofile(self.files[name])
+        self.lengths[name] += len(array)
+
+
+def open_store(path, mmap=True):
+    """Open a store; arrays are memory-mapped unless mmap is False"""
+    with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['version'] != VERSION:
+        raise ValueError("Unsupported materials store version: {}".format(meta['version']))
+
+    mode = 'r' if mmap else None
+
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+
+    columns = {name: load(name) for name in meta['columns']}
+    strings = {}
+    for name in meta['strings']:
+        blob, offsets = load(name), load(name + '.offsets')
+        table = MappedNames(blob, offsets)
+        strings[name] = table if mmap else list(table)
+    categories = {name: load('category.' + name) for name in meta['categories']}
+    element_masks = load('element_mask')
+    fractions = tuple(load('composition.' + name) for name in COMPOSITION_ARRAYS)
+    return MaterialStore(columns, strings, categories, element_masks, fractions)
+
+
+def append_store(path, materials):
+    """Rewrite a store with materials added (uncategorized, as --add did with the JSON)"""
+    store = open_store(path, mmap=False)
+    categories = {name: rows.tolist() for name, rows in store.categories.items()}
+    save_store(path, list(store) + list(materials), categories)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
@@ -0,0 +1,103 @@
+"""
+Prefix and fuzzy lookup of material names
+
+Used by 3_recommend.py for "did you mean" suggestions and autocomplete.
+
+Names are matched case-insensitively. Prefix search is a binary search on
+the sorted lower-cased names. Fuzzy search narrows the candidates with a
+trigram index (a name within edit distance d of the query shares at least
+len(trigrams) - 3d of the trigrams of either string) and a length filter,
+then checks every remaining name with the exact Levenshtein distance, so
+no match within the distance is dropped. Where that bound is <= 0 (short
+names and queries), every name passing the length filter is checked.
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+
+PAD = '\x00'
+
+
+def trigrams(text):
+    """Trigrams of text padded at both ends, so short names still have some"""
+    padded = PAD * 2 + text + PAD
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit=None):
+    """Levenshtein distance, or limit + 1 as soon as it must exceed limit"""
+    if limit is not None and abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class NameIndex:
+    """Sorted-array prefix search plus a trigram edit-distance index over names"""
+
+    def __init__(self, names):
+        entries = sorted((name.lower(), name) for name in names)
+        self.keys = [key for key, _ in entries]
+        self.names = [name for _, name in entries]
+        self.lengths = np.array([len(key) for key in self.keys], dtype=np.int32)
+
+        postings = {}
+        gram_counts = []
+        for i, key in enumerate(self.keys):
+            grams = trigrams(key)
+            gram_counts.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.gram_counts = np.array(gram_counts, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefix(self, prefix, limit=10):
+        """Names starting with prefix (case-insensitive), in sorted order"""
+        key = prefix.lower()
+        start = bisect_left(self.keys, key)
+        matches = []
+        for i in range(start, len(self.keys)):
+            if not self.keys[i].startswith(key) or (limit is not None and len(matches) >= limit):
+                break
+            matches.append(self.names[i])
+        return matches
+
+    def similar(self, query, limit=5, max_distance=2):
+        """Names within max_distance edits of query, as [(name, distance), ...] closest first"""
+        key = query.lower()
+        grams = trigrams(key)
+        lists = [self.postings[gram] for gram in grams if gram in self.postings]
+
+        shared = np.bincount(np.concatenate(lists) if lists else np.zeros(0, dtype=np.int32), minlength=len(self.keys))
+        # Not clamped: a name whose bound is <= 0 may share no trigram and still match
+        needed = np.maximum(len(grams), self.gram_counts) - 3 * max_distance
+        ids = np.flatnonzero((shared >= needed) & (np.abs(self.lengths - len(key)) <= max_distance))
+
+        matches = []
+        for i in ids.tolist():
+            distance = edit_distance(key, self.keys[i], max_distance)
+            if distance <= max_distance:
+                matches.append((distance, self.names[i]))
+        matches.sort()
+        return [(name, distance) for distance, name in matches[:limit]]
+
+    def suggest(self, query, limit=5, max_distance=2):
+        """ "Did you mean" candidates: closest fuzzy matches, then prefix matches"""
+        suggestions = [name for name, _ in self.similar(query, limit, max_distance)]
+        for name in self.prefix(query, limit):
+            if len(suggestions) >= limit:
+                break
+            if name not in suggestions:
+                suggestions.append(name)
+        return suggestions
@@ -0,0 +1,174 @@
+"""
+Columnar material properties with sorted range indexes
+
+Used by 3_recommend.py to filter recommendations by constraints such as
+"density < 4 and band_gap > 2 and has Ni and no Co".
+
+Each numeric property of the material data (a columnar store from
+material_store.py, or battery_cathodes.json) becomes one float64 column
+(NaN where a material lacks it) plus an argsort of that column. A range
+constraint is two binary searches on the sorted column, and the rows
+between them are the matches, so the cost follows the number of matches
+rather than the number of materials. Element clauses ("has Ni", "no Co")
+are bitmask tests on the element masks of the formulas (composition.py).
+"""
+
+import json
+import re
+
+import numpy as np
+
+from composition import element_masks, select
+from material_store import is_store, open_store
+
+# Comparison -> (lower bound inclusive, upper bound inclusive), None = unbounded side
+OPERATORS = {
+    '<': (None, False),
+    '<=': (None, True),
+    '>': (False, None),
+    '>=': (True, None),
+    '=': (True, True),
+    '==': (True, True),
+}
+
+CLAUSE = re.compile(r'^\s*([A-Za-z_]\w*)\s*(<=|>=|==|=|<|>)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$')
+ELEMENT_CLAUSE = re.compile(r'^\s*(has|no)\s+([A-Z][a-z]?)\s*$', re.IGNORECASE)
+# Column name of element clauses in parsed constraints
+ELEMENTS = 'elements'
+SEPARATOR = re.compile(r'\s+and\s+|,', re.IGNORECASE)
+
+
+def parse_constraints(text):
+    """
+    Parse "density < 4 and band_gap > 2" into ((column, op, value), ...)
+
+    Clauses are joined by "and" or commas; each is `column op number`
+    with op one of < <= > >= = ==, or `has Element` / `no Element`
+    (parsed as ('elements', 'has' / 'no', symbol)).
+    """
+    constraints = []
+    for clause in SEPARATOR.split(text):
+        if not clause.strip():
+            continue
+        match = ELEMENT_CLAUSE.match(clause)
+        if match is not None:
+            constraints.append((ELEMENTS, match.group(1).lower(), match.group(2)))
+            continue
+        match = CLAUSE.match(clause)
+        if match is None:
+            raise ValueError("Cannot parse constraint: '{}'".format(clause.strip()))
+        column, op, value = match.groups()
+        constraints.append((column, op, float(value)))
+    return tuple(constraints)
+
+
+class MaterialProperties:
+    """Property columns of materials, keyed by formula"""
+
+    def __init__(self, names, columns, masks=None):
+        self.names = names
+        self.row = {name: i for i, name in enumerate(names)}
+        self.columns = columns
+        # Element masks, (n, 2) uint64; parsed from the names when not given
+        self.masks = masks if masks is not None else element_masks(names)
+        self.order = {column: np.argsort(values, kind='stable') for column, values in columns.items()}
+        self.sorted = {column: values[self.order[column]] for column, values in columns.items()}
+        # NaN sorts last; ranges never reach past the known values
+        self.known = {column: int(np.count_nonzero(~np.isnan(values))) for column, values in columns.items()}
+
+    @classmethod
+    def from_materials(cls, materials):
+        """Build from material dicts; a repeated formula keeps its last entry, as in the graph"""
+        rows = {}
+        for mat in materials:
+            rows[mat.get('formula', 'Material_{}'.format(len(rows)))] = mat
+
+        names = list(rows)
+        keys = {}
+        for mat in rows.values():
+            for key, value in mat.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    keys[key] = True
+
+        columns = {}
+        for key in keys:
+            values = [rows[name].get(key) for name in names]
+            columns[key] = np.array([value if isinstance(value, (int, float)) else np.nan for value in values],
+                                    dtype=np.float64)
+        return cls(names, columns)
+
+    @classmethod
+    def load(cls, path):
+        """Load a materials store directory or a JSON file"""
+        if is_store(path):
+            return cls.from_store(open_store(path))
+        return cls.from_json(path)
+
+    @classmethod
+    def from_store(cls, store):
+        """Take the columns of a MaterialStore; a repeated formula keeps its last row"""
+        last = {}
+        for i, formula in enumerate(store.strings['formula']):
+            last[formula or 'Material_{}'.format(i)] = i
+        rows = np.fromiter(last.values(), dtype=np.int64, count=len(last))
+        columns = {name: np.asarray(values, dtype=np.float64)[rows] for name, values in store.columns.items()}
+        return cls(list(last), columns, np.asarray(store.element_masks)[rows])
+
+    @classmethod
+    def from_json(cls, path):
+        """Load battery_cathodes.json (category dict or flat list)"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        materials = []
+        if isinstance(data, dict):
+            for category_materials in data.values():
+                if isinstance(category_materials, list):
+                    materials.extend(category_materials)
+        else:
+            materials = data
+
+        # Same de-duplication as 2_processing.load_materials
+        seen_ids = set()
+        unique = []
+        for mat in materials:
+            mat_id = mat.get('material_id', 'unknown')
+            if mat_id not in seen_ids:
+                seen_ids.add(mat_id)
+                unique.append(mat)
+        return cls.from_materials(unique)
+
+    def __len__(self):
+        return len(self.names)
+
+    def range_rows(self, column, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        """Row indices with low <(=) value <(=) high, from the sorted index (NaN never matches)"""
+        if column not in self.columns:
+            raise ValueError("Unknown property '{}' (available: {})".format(column, ', '.join(sorted(self.columns))))
+        values = self.sorted[column][:self.known[column]]
+        start, stop = 0, len(values)
+        if low is not None:
+            start = int(np.searchsorted(values, low, side='left' if low_inclusive else 'right'))
+        if high is not None:
+            stop = int(np.searchsorted(values, high, side='right' if high_inclusive else 'left'))
+        return self.order[column][start:max(start, stop)]
+
+    def matching(self, constraints):
+        """Boolean row mask of the materials satisfying every (column, op, value) constraint"""
+        mask = np.ones(len(self.names), dtype=bool)
+        for column, op, value in constraints:
+            if column == ELEMENTS:
+                mask &= select(self.masks, include=[value] if op == 'has' else [], exclude=[value] if op == 'no' else [])
+                continue
+            low_inclusive, high_inclusive = OPERATORS[op]
+            rows = self.range_rows(
+                column,
+                low=value if low_inclusive is not None else None,
+                high=value if high_inclusive is not None else None,
+                low_inclusive=bool(low_inclusive),
+                high_inclusive=bool(high_inclusive),
+            )
+            selected = np.zeros(len(self.names), dtype=bool)
+            selected[rows] = True
+            mask &= selected
+        return mask
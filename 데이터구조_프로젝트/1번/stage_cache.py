@@ -0,0 +1,161 @@
+"""
+Content-addressed artifact cache for the pipeline stages
+
+Used by 1_dataload.py and 2_processing.py to skip a stage whose inputs,
+parameters and code are unchanged since an earlier run.
+
+A stage key is the SHA-256 of
+  - the stage name,
+  - the contents of the stage's source files (code changes invalidate),
+  - the contents of its input files / directories, and
+  - its parameters as canonical JSON.
+Outputs are copied to <cache dir>/<key>/output<i> (one fixed name per
+output slot, so the output paths are not part of the key) and copied back
+on a hit, unless the output on disk already has the same content.
+Content hashes of inputs are remembered per (path, size, mtime) so an
+unchanged multi-GB input is not re-read on every run. When the cache
+grows past max_bytes, the least recently used artifacts are removed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+DEFAULT_CACHE_DIR = '.stage_cache'
+DEFAULT_MAX_MB = 1024
+INDEX_FILE = 'index.json'
+CHUNK = 1 << 20
+
+
+class StageCache:
+    """Artifacts of pipeline stages keyed by the hash of what produced them"""
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_MB << 20):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self.index = {'artifacts': {}, 'digests': {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+
+    def key(self, stage, sources, inputs, params):
+        """Hex key of a stage run"""
+        h = hashlib.sha256()
+        h.update(stage.encode('utf-8'))
+        for path in list(sources) + list(inputs):
+            h.update(b'\0' + os.path.basename(path).encode('utf-8') + b'\0')
+            h.update(self.digest(path).encode('ascii') if os.path.exists(path) else b'missing')
+        h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+        return h.hexdigest()
+
+    def digest(self, path):
+        """Content hash of a file, or of every file under a directory"""
+        if os.path.isdir(path):
+            h = hashlib.sha256()
+            for name in sorted(os.listdir(path)):
+                h.update(name.encode('utf-8') + b'\0' + self.digest(os.path.join(path, name)).encode('ascii'))
+            return h.hexdigest()
+
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        known = self.index['digests'].get(path)
+        if known and known[0] == signature:
+            return known[1]
+
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(CHUNK), b''):
+                h.update(block)
+        self.index['digests'][path] = [signature, h.hexdigest()]
+        return h.hexdigest()
+
+    def restore(self, key, outputs):
+        """Copy a cached artifact to outputs; False if the key (or any of its files) is not cached"""
+        entry = self.index['artifacts'].get(key)
+        directory = os.path.join(self.root, key)
+        if entry is None or not os.path.isdir(directory):
+            return False
+        cached_files = [os.path.join(directory, _slot(i)) for i in range(len(outputs))]
+        if not all(os.path.exists(cached) for cached in cached_files):
+            return False
+
+        for output, cached in zip(outputs, cached_files):
+            # An output already holding the cached content is left alone
+            if not (os.path.exists(output) and self.digest(output) == self.digest(cached)):
+                _copy(cached, output)
+        entry['last_used'] = time.time()
+        self._save_index()
+        return True
+
+    def store(self, key, stage, outputs):
+        """Copy outputs into the cache under key, then evict down to max_bytes"""
+        directory = os.path.join(self.root, key)
+        staging = directory + '.tmp'
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        for i, output in enumerate(outputs):
+            _copy(output, os.path.join(staging, _slot(i)))
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(staging, directory)
+
+        now = time.time()
+        self.index['artifacts'][key] = {'stage': stage, 'bytes': _size(directory), 'created': now, 'last_used': now}
+        self.evict(keep=key)
+        self._save_index()
+
+    def evict(self, keep=None):
+        """Remove least recently used artifacts until the cache fits max_bytes"""
+        artifacts = self.index['artifacts']
+        total = sum(entry['bytes'] for entry in artifacts.values())
+        for key in sorted(artifacts, key=lambda key: artifacts[key]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= artifacts[key]['bytes']
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            del artifacts[key]
+
+    def _save_index(self):
+        # Forget digests of inputs that no longer exist
+        self.index['digests'] = {path: value for path, value in self.index['digests'].items() if os.path.exists(path)}
+        os.makedirs(self.root, exist_ok=True)
+        temporary = self.index_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(temporary, self.index_path)
+
+
+def _slot(i):
+    """File name of the i-th output inside an artifact directory"""
+    return 'output{}'.format(i)
+
+
+def _copy(source, target):
+    """
+    Copy a file or a directory tree, replacing target
+
+    The copy is made beside target and renamed over it, so a reader that
+    has the old target memory-mapped is never left with a truncated file.
+    """
+    temporary = target + '.tmp'
+    if os.path.isdir(source):
+        if os.path.exists(temporary):
+            shutil.rmtree(temporary)
+        shutil.copytree(source, temporary)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+    else:
+        shutil.copy2(source, temporary)
+    os.replace(temporary, target)
+
+
+def _size(path):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(path) for name in names)
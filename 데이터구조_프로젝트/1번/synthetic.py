@@ -0,0 +1,136 @@
+"""
+Seeded synthetic cathode catalogue of any size
+
+Used by 1_dataload.py (test data when there is no CSV) and
+benchmark_pipeline.py (10k / 100k / 1M material runs).
+
+Materials are drawn from cathode families (layered LCO / NCM / NCA,
+olivine phosphates, spinels, a few others). Each family expands into
+composition variants on a fraction grid, e.g. LiNi0.6Mn0.2Co0.2O2 or
+LiFe0.75Mn0.25PO4, and has its own property distribution (mean and
+spread of density, band gap, formation energy and cell volume); each
+variant adds a fixed offset so materials of one formula cluster. A
+formula drawn again gets a "_<n>" copy suffix, as in the old test data.
+Everything is generated with NumPy arrays from one seed: the same
+(n, seed) always gives the same catalogue.
+"""
+
+import numpy as np
+
+# Numeric columns in generation order, with decimals kept and lower/upper clip bounds
+PROPERTIES = [
+    ('density', 2, 1.5, None),
+    ('band_gap', 2, 0.0, None),
+    ('formation_energy_per_atom', 3, None, 0.5),
+    ('volume', 1, 20.0, None),
+]
+
+# Share of each family and its (mean, std) per property, in PROPERTIES order
+FAMILIES = {
+    'LCO': (0.20, [(5.00, 0.08), (2.2, 0.5), (-1.70, 0.12), (96.5, 2.0)]),
+    'NCM': (0.30, [(4.75, 0.12), (1.2, 0.5), (-1.55, 0.15), (101.0, 2.5)]),
+    'NCA': (0.10, [(4.80, 0.10), (1.0, 0.4), (-1.60, 0.12), (101.5, 2.0)]),
+    'olivine': (0.20, [(3.60, 0.10), (3.7, 0.3), (-2.55, 0.10), (293.0, 4.0)]),
+    'spinel': (0.15, [(4.25, 0.10), (1.5, 0.6), (-1.95, 0.10), (545.0, 8.0)]),
+    'other': (0.05, [(4.00, 0.60), (2.5, 1.2), (-2.20, 0.40), (150.0, 50.0)]),
+}
+
+# Per-variant offset as a fraction of the family std
+VARIANT_SPREAD = 0.5
+
+
+def _formula(*parts):
+    """'Li', 1, 'Ni', 0.6, ... -> 'LiNi0.6...' (amounts of 1 left out, of 0 dropped)"""
+    text = ''
+    for element, amount in zip(parts[::2], parts[1::2]):
+        amount = round(amount, 2)
+        if amount == 0:
+            continue
+        text += element if amount == 1 else '{}{:g}'.format(element, amount)
+    return text
+
+
+def _grid(start, stop, step):
+    return [round(x, 2) for x in np.arange(start, stop + step / 2, step)]
+
+
+def family_variants():
+    """{family: [formula, ...]} composition variants of each family"""
+    layered = [_formula('Li', 1, 'Co', 1, 'O', 2)]
+    layered += [_formula('Li', 1, 'Co', 1 - x, dopant, x, 'O', 2)
+                for dopant in ['Al', 'Mg', 'Ti'] for x in _grid(0.01, 0.1, 0.01)]
+
+    ncm = [_formula('Li', 1, 'Ni', a, 'Mn', b, 'Co', round(1 - a - b, 2), 'O', 2)
+           for a in _grid(0.05, 0.9, 0.05) for b in _grid(0.05, 0.9, 0.05) if round(1 - a - b, 2) >= 0.05]
+
+    nca = [_formula('Li', 1, 'Ni', round(1 - b - c, 2), 'Co', b, 'Al', c, 'O', 2)
+           for b in _grid(0.05, 0.2, 0.05) for c in _grid(0.01, 0.05, 0.01)]
+
+    olivine = [_formula('Li', 1, 'Fe', 1 - x, 'Mn', x, 'P', 1, 'O', 4) for x in _grid(0.0, 0.95, 0.05)]
+    olivine += [_formula('Li', 1, metal, 1, 'P', 1, 'O', 4) for metal in ['Mn', 'Co', 'Ni']]
+
+    spinel = [_formula('Li', 1, 'Mn', 2 - x, dopant, x, 'O', 4)
+              for dopant in ['Ni', 'Al'] for x in _grid(0.0, 0.5, 0.05)]
+
+    other = ['LiVO2', 'LiTiO2', 'LiNbO3', 'LiFeO2', 'Li2MnO3', 'LiMnO2', 'Li2FeSiO4', 'Li2MnSiO4', 'LiNiO2']
+
+    return {
+        'LCO': layered,
+        'NCM': ncm,
+        'NCA': nca,
+        'olivine': olivine,
+        'spinel': list(dict.fromkeys(spinel)),
+        'other': other,
+    }
+
+
+def generate_columns(n, seed=0):
+    """
+    Synthetic catalogue of n materials as columns
+
+    Returns:
+        (numeric {name: float64[n]}, strings {'material_id': [str], 'formula': [str]})
+        ready for material_store.save_columns()
+    """
+    rng = np.random.default_rng(seed)
+    variants = family_variants()
+    names = list(FAMILIES)
+
+    table = np.array([formula for name in names for formula in variants[name]], dtype=object)
+    counts = np.array([len(variants[name]) for name in names])
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    shares = np.array([FAMILIES[name][0] for name in names])
+    stats = np.array([FAMILIES[name][1] for name in names])  # (families, properties, 2)
+
+    family = rng.choice(len(names), size=n, p=shares / shares.sum())
+    variant = starts[family] + (rng.random(n) * counts[family]).astype(np.int64)
+
+    mean, std = stats[family, :, 0], stats[family, :, 1]
+    offsets = rng.normal(0.0, VARIANT_SPREAD, (len(table), len(PROPERTIES)))
+    values = mean + std * (offsets[variant] + rng.standard_normal((n, len(PROPERTIES))))
+
+    numeric = {}
+    for j, (name, decimals, low, high) in enumerate(PROPERTIES):
+        numeric[name] = np.round(np.clip(values[:, j], low, high), decimals)
+
+    # Copy number of each row among the rows of its formula
+    order = np.argsort(variant, kind='stable')
+    ranked = variant[order]
+    first = np.flatnonzero(np.r_[True, ranked[1:] != ranked[:-1]])
+    copy = np.empty(n, dtype=np.int64)
+    copy[order] = np.arange(n) - np.repeat(first, np.diff(np.r_[first, n]))
+
+    formulas = [formula if k == 0 else '{}_{}'.format(formula, k) for formula, k in zip(table[variant], copy.tolist())]
+    strings = {
+        'material_id': ['mp-{}'.format(10000 + i) for i in range(n)],
+        'formula': formulas,
+    }
+    return numeric, strings
+
+
+def generate_materials(n, seed=0):
+    """Synthetic catalogue of n materials as material dicts"""
+    numeric, strings = generate_columns(n, seed)
+    names = list(strings) + list(numeric)
+    columns = list(strings.values()) + [values.tolist() for values in numeric.values()]
+    return [dict(zip(names, row)) for row in zip(*columns)]
@@ -0,0 +1,70 @@
+"""save_csr must round-trip through load_csr and open_csr: adjacency, params and name lookup"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from graph_store import CSRAdjacency, CSRGraph, is_csr_file, load_csr, open_csr, save_csr
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARAMS = {'threshold': 0.8780059814453125, 'knn': None,
+          'build': {'threshold': 0.85, 'knn': None, 'ann': None, 'candidates': 0}}
+
+
+@pytest.fixture(scope='module')
+def adjacency():
+    with open(os.path.join(PROJECT_DIR, 'adjacency_list.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('score_dtype', ['float32', 'float16'])
+@pytest.mark.parametrize('reader', [load_csr, open_csr])
+def test_round_trip(tmp_path, adjacency, reader, score_dtype):
+    path = str(tmp_path / 'graph.csr')
+    save_csr(CSRGraph.from_adjacency(adjacency, score_dtype, PARAMS), path)
+    assert is_csr_file(path)
+    assert not os.path.exists(path + '.tmp')
+
+    graph = reader(path)
+    assert graph.params == PARAMS
+    assert graph.scores.dtype == np.dtype(score_dtype)
+    assert list(graph.names) == list(adjacency)
+    if score_dtype == 'float32':
+        assert graph.to_adjacency() == adjacency
+    else:
+        restored = graph.to_adjacency()
+        for name, neighbors in adjacency.items():
+            assert [n['neighbor'] for n in restored[name]] == [n['neighbor'] for n in neighbors]
+            assert np.allclose([n['similarity'] for n in restored[name]],
+                               [n['similarity'] for n in neighbors], atol=1e-3)
+
+
+def test_mapped_lookup(tmp_path, adjacency):
+    path = str(tmp_path / 'graph.csr')
+    save_csr(CSRGraph.from_adjacency(adjacency), path)
+    view = CSRAdjacency(open_csr(path))
+    for name, neighbors in adjacency.items():
+        assert name in view
+        assert view[name] == neighbors
+        assert view.degree(name) == len(neighbors)
+        assert view.neighbors(name, 2) == neighbors[:2]
+    assert 'NotAMaterial' not in view
+
+
+def test_params_optional(tmp_path, adjacency):
+    path = str(tmp_path / 'graph.csr')
+    save_csr(CSRGraph.from_adjacency(adjacency), path)
+    assert load_csr(path).params is None
+    assert open_csr(path).params is None
+
+
+def test_rewrite_keeps_open_map(tmp_path, adjacency):
+    """A rewrite replaces the file, so a graph mapped before it still reads the old rows"""
+    path = str(tmp_path / 'graph.csr')
+    save_csr(CSRGraph.from_adjacency(adjacency), path)
+    mapped = open_csr(path)
+    save_csr(CSRGraph.from_adjacency({name: [] for name in adjacency}), path)
+    assert mapped.to_adjacency() == adjacency
+    assert load_csr(path).num_edges == 0
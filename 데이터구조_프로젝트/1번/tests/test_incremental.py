@@ -0,0 +1,96 @@
+"""
+SimilarityGraphBuilder.update() (2_processing.py --add) must give the
+graph a full rebuild gives, for graphs reloaded from disk with the build
+parameters stored in them.
+"""
+
+import contextlib
+import importlib.util
+import io
+import os
+
+import numpy as np
+import pytest
+
+from synthetic import generate_materials
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+N_OLD = 2950
+N_NEW = 50
+
+
+def load_processing():
+    spec = importlib.util.spec_from_file_location('processing', os.path.join(PROJECT_DIR, '2_processing.py'))
+    processing = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(processing)
+    return processing
+
+
+processing = load_processing()
+
+
+@pytest.fixture(scope='module')
+def catalogue():
+    """(old materials, new materials inside the old feature range, new materials outside it)"""
+    materials = generate_materials(N_OLD + N_NEW, seed=1)
+    feature_matrix, _, _ = processing.extract_features(materials)
+    low, high = feature_matrix[:N_OLD].min(axis=0), feature_matrix[:N_OLD].max(axis=0)
+    inside = np.all((feature_matrix[N_OLD:] >= low) & (feature_matrix[N_OLD:] <= high), axis=1)
+    new = materials[N_OLD:]
+    return (materials[:N_OLD], [mat for mat, ok in zip(new, inside) if ok],
+            [mat for mat, ok in zip(new, inside) if not ok])
+
+
+def quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def updated(tmp_path, old, new, format='csr', fixed_scale=False, **build):
+    """Graph built on old, saved, reloaded into a fresh builder and updated with new"""
+    path = str(tmp_path / 'graph.{}'.format(format))
+    builder = processing.SimilarityGraphBuilder().fit(old)
+    quiet(builder.build, **build)
+    builder.save(path, format=format)
+
+    builder = processing.SimilarityGraphBuilder().fit(old)
+    builder.load(path)
+    quiet(builder.update, new, fixed_scale=fixed_scale)
+    return builder
+
+
+@pytest.mark.parametrize('format', ['csr', 'json'])
+def test_knn_update_matches_rebuild(tmp_path, catalogue, format):
+    old, inside, _ = catalogue
+    builder = updated(tmp_path, old, inside, format, knn=5)
+    assert builder.knn == 5
+
+    rebuilt = processing.SimilarityGraphBuilder().fit(old + inside)
+    quiet(rebuilt.build, knn=5)
+    assert builder.adjacency == rebuilt.adjacency
+
+
+@pytest.mark.parametrize('format', ['csr', 'json'])
+def test_threshold_update_matches_rebuild(tmp_path, catalogue, format):
+    old, inside, _ = catalogue
+    # More decimals than the stored scores keep, so it cannot be read back from them
+    builder = updated(tmp_path, old, inside, format, threshold=0.96543)
+    assert builder.threshold == 0.96543
+
+    rebuilt = processing.SimilarityGraphBuilder().fit(old + inside)
+    adjacency = quiet(processing.build_adjacency, rebuilt.features, rebuilt.idx_to_material,
+                      builder.threshold, rebuilt.block_size)
+    assert builder.adjacency == adjacency
+
+
+def test_fixed_scale_update_matches_rebuild(tmp_path, catalogue):
+    old, _, outside = catalogue
+    assert outside
+    builder = updated(tmp_path, old, outside, fixed_scale=True, threshold=0.95)
+
+    # A rebuild over all materials normalized with the old range
+    reference = processing.SimilarityGraphBuilder().fit(old)
+    feature_matrix, _, idx_to_material = processing.extract_features(old + outside)
+    features = processing.prepare_features(feature_matrix, reference.scaler)
+    adjacency = quiet(processing.build_adjacency, features, idx_to_material, builder.threshold, reference.block_size)
+    assert builder.adjacency == adjacency
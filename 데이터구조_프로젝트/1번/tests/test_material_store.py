@@ -0,0 +1,44 @@
+"""StoreWriter must write the same store whether rows come in one save_columns() call or in chunks"""
+
+import os
+
+import numpy as np
+import pytest
+
+from composition import categorize, element_masks
+from material_store import StoreWriter, open_store, save_columns
+from synthetic import generate_columns
+
+
+def store_files(path):
+    files = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb') as f:
+            files[name] = f.read()
+    return files
+
+
+@pytest.mark.parametrize('n, chunk', [(0, 10), (1, 10), (2000, 1), (2000, 337), (2000, 5000)])
+def test_chunked_writes(tmp_path, n, chunk):
+    numeric, strings = generate_columns(n, 0)
+    categories = categorize(element_masks(strings['formula']))
+    save_columns(str(tmp_path / 'whole'), numeric, strings, categories)
+
+    writer = StoreWriter(str(tmp_path / 'chunked'))
+    for start in range(0, n, chunk):
+        rows = slice(start, start + chunk)
+        chunk_categories = categorize(element_masks(strings['formula'][rows]))
+        writer.append({name: values[rows] for name, values in numeric.items()},
+                      {name: values[rows] for name, values in strings.items()}, chunk_categories)
+    if n == 0:
+        writer.append(numeric, strings, categories)
+    writer.close()
+
+    assert store_files(tmp_path / 'chunked') == store_files(tmp_path / 'whole')
+    store = open_store(str(tmp_path / 'chunked'))
+    assert len(store) == n
+    assert list(store.strings['formula']) == list(strings['formula'])
+    for name, rows in categories.items():
+        assert np.array_equal(store.category(name), rows)
+    if n:
+        assert store.fractions(n - 1) == open_store(str(tmp_path / 'whole')).fractions(n - 1)
@@ -0,0 +1,45 @@
+"""NameIndex.similar() must return what a brute-force edit-distance scan returns"""
+
+import random
+
+import pytest
+
+from name_index import NameIndex, edit_distance
+from synthetic import generate_materials
+
+
+@pytest.fixture(scope='module')
+def names():
+    formulas = {mat['formula'] for mat in generate_materials(2000, seed=0)}
+    # Short names, where the trigram bound gives no guarantee
+    return sorted(formulas | {'LiO', 'Li2O', 'NiO', 'CoO', 'FeS', 'MnO2', 'V2O5', 'TiS2', 'S'})
+
+
+def brute_force(names, query, limit=5, max_distance=2):
+    key = query.lower()
+    matches = sorted((edit_distance(key, name.lower(), max_distance), name) for name in names)
+    return [(name, distance) for distance, name in matches if distance <= max_distance][:limit]
+
+
+def typos(name, rng):
+    """One deletion, one substitution and one insertion of name"""
+    i = rng.randrange(len(name))
+    char = rng.choice('abcdefghijklmnopqrstuvwxyz0123456789.')
+    return [name[:i] + name[i + 1:], name[:i] + char + name[i + 1:], name[:i] + char + name[i:]]
+
+
+def test_matches_brute_force(names):
+    index = NameIndex(names)
+    rng = random.Random(0)
+    queries = ['LiFeP04', 'LiCo02', 'LiMn204', 'lifepo4', 'Li', 'O', 'CoS', 'xyz', 'S2', '']
+    for name in rng.sample(names, 40) + ['LiO', 'NiO', 'V2O5', 'S']:
+        queries.extend(typos(name, rng))
+
+    for query in queries:
+        assert index.similar(query) == brute_force(names, query), query
+
+
+def test_typo_finds_original(names):
+    index = NameIndex(names)
+    for query, expected in [('LiCo02', 'LiCoO2'), ('LiFeP04', 'LiFePO4'), ('LiMn204', 'LiMn2O4'), ('Ni0', 'NiO')]:
+        assert expected in [name for name, _ in index.similar(query, limit=10)], query
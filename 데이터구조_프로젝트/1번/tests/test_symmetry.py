@@ -0,0 +1,50 @@
+"""
+The upper-triangular build must write the same adjacency_list.json as
+the full build, byte for byte. This holds only while every similarity
+block is exactly symmetric (see cosine_block and structural_block).
+"""
+
+import importlib.util
+import json
+import os
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_processing():
+    spec = importlib.util.spec_from_file_location('processing', os.path.join(PROJECT_DIR, '2_processing.py'))
+    processing = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(processing)
+    return processing
+
+
+processing = load_processing()
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    materials = processing.load_materials(os.path.join(PROJECT_DIR, 'battery_cathodes.json'))
+    feature_matrix, _, idx_to_material = processing.extract_features(materials)
+    return processing.prepare_features(feature_matrix), idx_to_material
+
+
+def dump(adjacency):
+    return json.dumps(adjacency, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 32, 1024])
+def test_symmetric_build_is_byte_identical(fitted, block_size):
+    features, idx_to_material = fitted
+    threshold = processing.DEFAULT_THRESHOLD
+    full = processing.build_adjacency(features, idx_to_material, threshold, block_size, symmetric=False)
+    half = processing.build_adjacency(features, idx_to_material, threshold, block_size, symmetric=True)
+    assert dump(half) == dump(full)
+
+
+def test_blocks_are_bitwise_symmetric(fitted):
+    features, _ = fitted
+    n = len(features['normalized'])
+    scores = processing.hybrid_block(features, slice(0, n), slice(0, n))
+    assert scores.tobytes() == scores.T.copy().tobytes()